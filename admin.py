@@ -1,27 +1,84 @@
 # http://www.ibm.com/developerworks/opensource/library/os-django-admin/index.html
 
+import datetime
+
 import models
+import view_cache
+import visibility
 import django.contrib.admin
 
+from django.contrib.admin.util import quote
+from django.contrib.admin.views.main import ChangeList
+from django.core.urlresolvers import reverse
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.utils.text import capfirst
+
 from binder.admin import AdminWithReadOnly
 from forms import DocumentForm
 
+class DocumentChangeList(ChangeList):
+    def get_query_set(self, request):
+        """
+        Fetch the authors of all documents on the page at once, rather
+        than one query per row for the Authors column.
+        """
+        qs = super(DocumentChangeList, self).get_query_set(request)
+        return qs.select_related('document_type', 'uploader'). \
+            prefetch_related('authors')
+
 class DocumentAdmin(AdminWithReadOnly):
     list_display = ('title', models.Document.get_authors)
-    readonly_fields = ('uploader',)
+    readonly_fields = ('uploader', 'extraction_status')
+    actions = ['soft_delete_selected', 'restore_selected']
 
-    def queryset(self, request):
-        if request.user.groups.filter(name='Guest'):
-            limit_to_program = request.user.program
-        else:
-            limit_to_program = None
+    def get_changelist(self, request, **kwargs):
+        return DocumentChangeList
 
+    def queryset(self, request):
         qs = super(self.__class__, self).queryset(request)
-        
-        if limit_to_program:
-            return qs.filter(programs=limit_to_program)
-        else:
-            return qs
+        return visibility.filter_documents(qs, request)
+
+    def changelist_view(self, request, extra_context=None):
+        """
+        Show how many documents are still waiting to be indexed, if
+        queued indexing is enabled.
+        """
+
+        import indexing
+        context = {}
+
+        if indexing.is_enabled():
+            context['index_backlog'] = indexing.get_backlog_count()
+            context['index_failed'] = indexing.get_failed_count()
+
+        context.update(extra_context or {})
+        return super(DocumentAdmin, self).changelist_view(request,
+            extra_context=context)
+
+    def get_actions(self, request):
+        """
+        Remove the default delete_selected action, which would delete
+        the documents from the database instead of soft-deleting them.
+        """
+
+        actions = super(DocumentAdmin, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def render_change_form(self, request, context, add=False, change=False,
+        form_url='', obj=None):
+        """
+        Give the read-only page a key to cache its fields under, see
+        view_cache.py.
+        """
+
+        if obj is not None and obj.pk is not None:
+            context['document_view_cache_key'] = view_cache.get_key(obj,
+                request)
+
+        return super(DocumentAdmin, self).render_change_form(request,
+            context, add, change, form_url, obj)
 
     def get_form_class(self, request, obj=None, **kwargs):
         return DocumentForm
@@ -35,10 +92,8 @@ class DocumentAdmin(AdminWithReadOnly):
             # so they don't end up sending an email either, which is what
             # we want. We could also check for change=True.
 
-            # Load a copy of the document, so that it still has an ID
-            # if the caller delete()s it later
-            
-            document = models.Document.objects.get(id=document.id) 
+            # The email is rendered now, while the document still has an
+            # ID, and sent later if queued email is enabled.
 
             from django.conf import settings
             context = {
@@ -47,10 +102,8 @@ class DocumentAdmin(AdminWithReadOnly):
                 'settings': settings,
             }
 
-            from mail_templated import EmailMessage
-            email = EmailMessage(template, context,
-                to=[document.uploader.email])
-            email.send()
+            import notifications
+            notifications.notify(template, context, document.uploader.email)
 
     def save_form(self, request, form, change):
         """
@@ -65,8 +118,30 @@ class DocumentAdmin(AdminWithReadOnly):
 
         document = super(DocumentAdmin, self).save_form(request, form, change)
         document.uploader = request.user
+
+        duplicates = getattr(form, 'duplicates', [])
+        if duplicates:
+            from django.contrib import messages
+            messages.warning(request, "The file that you uploaded is the " +
+                "same as the one attached to: %s" % ", ".join(
+                    d.title for d in duplicates))
+
         return document
     
+    def save_related(self, request, form, formsets, change):
+        """
+        Reindex the document once its authors and programs are saved,
+        which happens after the document itself, and therefore after it
+        was indexed by the post_save signal. Search results are limited
+        by the indexed programs, and show the indexed names.
+        """
+
+        super(DocumentAdmin, self).save_related(request, form, formsets,
+            change)
+
+        import indexing
+        indexing.update_documents([form.instance.pk])
+
     def delete_model(self, request, document):
         """
         Override the default delete_model() to send notification emails
@@ -78,6 +153,75 @@ class DocumentAdmin(AdminWithReadOnly):
         document.deleted = True
         document.save()
 
+    def set_deleted(self, request, queryset, deleted, template):
+        """
+        Soft-delete or restore all the selected documents that the user
+        may delete, with a single UPDATE and a single batched index
+        update, record the change in their history, and send one email
+        to each uploader listing all of their documents that changed.
+        """
+
+        if not self.has_delete_permission(request):
+            # only their own documents
+            queryset = queryset.filter(uploader=request.user)
+
+        documents = list(queryset.exclude(deleted=deleted).select_related(
+            'uploader'))
+        ids = [document.id for document in documents]
+        models.Document.objects.filter(id__in=ids).update(deleted=deleted)
+        view_cache.bump_documents(ids)
+        self.log_changes(request, documents,
+            "Deleted." if deleted else "Restored.")
+
+        import indexing
+        indexing.update_documents(ids)
+
+        by_uploader = {}
+        for document in documents:
+            if document.uploader and document.uploader != request.user:
+                by_uploader.setdefault(document.uploader, []).append(document)
+
+        from django.conf import settings
+        import notifications
+
+        for uploader, uploaded in by_uploader.iteritems():
+            context = {
+                'documents': uploaded,
+                'user': request.user,
+                'settings': settings,
+            }
+            notifications.notify(template, context, uploader.email)
+
+        return len(ids)
+
+    def log_changes(self, request, documents, message):
+        """
+        Like log_change() for each of the documents, but with a single
+        INSERT.
+        """
+
+        from django.contrib.admin.models import LogEntry, CHANGE
+        from django.contrib.contenttypes.models import ContentType
+        from django.utils.encoding import force_unicode
+
+        content_type = ContentType.objects.get_for_model(models.Document)
+        LogEntry.objects.bulk_create([LogEntry(user_id=request.user.pk,
+            content_type=content_type, object_id=force_unicode(document.pk),
+            object_repr=force_unicode(document)[:200], action_flag=CHANGE,
+            change_message=message) for document in documents])
+
+    def soft_delete_selected(self, request, queryset):
+        count = self.set_deleted(request, queryset, True,
+            'email/documents_deleted.txt.django')
+        self.message_user(request, "%d documents deleted." % count)
+    soft_delete_selected.short_description = "Delete selected documents"
+
+    def restore_selected(self, request, queryset):
+        count = self.set_deleted(request, queryset, False,
+            'email/documents_restored.txt.django')
+        self.message_user(request, "%d documents restored." % count)
+    restore_selected.short_description = "Restore selected documents"
+
     """
     def delete_view(self, request, object_id, extra_context=None):
         return AdminWithReadOnly.delete_view(self, request, object_id, extra_context=extra_context)
@@ -97,67 +241,69 @@ class DocumentAdmin(AdminWithReadOnly):
             
     def get_deleted_objects(self, objs, opts, request, using):
         """
-        Find all objects related to ``objs`` that should also be deleted. ``objs``
-        must be a homogenous iterable of objects (e.g. a QuerySet).
-    
-        Returns a nested list of strings suitable for display in the
-        template with the ``unordered_list`` filter.
-        
-        Copied from django.contrib.admin.util.get_deleted_objects and
-        extended to override delete permissions to take the object's
-        uploader into account, by allowing deletion if has_delete_permission()
-        returns True.
+        Return the same as django.contrib.admin.util.get_deleted_objects:
+        a list of strings describing the objects that would be deleted,
+        for the template's ``unordered_list`` filter, a set of the names
+        of models that the user lacks permission to delete, and a list of
+        protected objects.
+
+        Documents are only soft-deleted (see delete_model()), so nothing
+        related to them is deleted too, and there's no need to walk all
+        their related objects with a NestedObjects collector. Permission
+        to delete takes the document's uploader into account, by asking
+        has_delete_permission().
         """
 
-        from django.contrib.admin.util import NestedObjects
-        collector = NestedObjects(using=using)
-        collector.collect(objs)
         perms_needed = set()
-    
-        def format_callback(obj):
-            has_admin = obj.__class__ in self.admin_site._registry
-            opts = obj._meta
-
-            from django.utils.html import escape
-            from django.utils.safestring import mark_safe
-            from django.utils.text import capfirst
-            from django.core.urlresolvers import reverse
-    
-            if has_admin:
-                from django.contrib.admin.util import quote
-                admin_url = reverse('%s:%s_%s_change'
-                                    % (self.admin_site.name,
-                                       opts.app_label,
-                                       opts.object_name.lower()),
-                                    None, (quote(obj._get_pk_val()),))
-                p = '%s.%s' % (opts.app_label,
-                               opts.get_delete_permission())
-                
-                if isinstance(obj, self.model):
-                    if not self.has_delete_permission(request, obj):
-                        perms_needed.add(opts.verbose_name)
-                elif not request.user.has_perm(p):
-                    perms_needed.add(opts.verbose_name)
-                # Display a link to the admin page.
-
-                return mark_safe(u'%s: <a href="%s">%s</a>' %
-                                 (escape(capfirst(opts.verbose_name)),
-                                  admin_url,
-                                  escape(obj)))
-            else:
-                # Don't display link to edit, because it either has no
-                # admin or is edited inline.
-                from django.utils.encoding import force_unicode
-                return u'%s: %s' % (capfirst(opts.verbose_name),
-                                    force_unicode(obj))
-    
-        to_delete = collector.nested(format_callback)
-    
-        protected = [format_callback(obj) for obj in collector.protected]
-    
-        return to_delete, perms_needed, protected
+        to_delete = []
+
+        for obj in objs:
+            if not self.has_delete_permission(request, obj):
+                perms_needed.add(opts.verbose_name)
+
+            admin_url = reverse('%s:%s_%s_change' % (self.admin_site.name,
+                opts.app_label, opts.object_name.lower()), None,
+                (quote(obj._get_pk_val()),))
+            to_delete.append(mark_safe(u'%s: <a href="%s">%s</a>' %
+                (escape(capfirst(opts.verbose_name)), admin_url,
+                    escape(obj))))
+
+        return to_delete, perms_needed, []
 
 django.contrib.admin.site.register(models.Document, DocumentAdmin)
 
 django.contrib.admin.site.register(models.DocumentType, 
     django.contrib.admin.ModelAdmin)
+
+class IndexQueueEntryAdmin(django.contrib.admin.ModelAdmin):
+    list_display = ('document_id', 'action', 'status', 'attempts',
+        'next_attempt', 'modified')
+    list_filter = ('status', 'action')
+    readonly_fields = ('last_error',)
+    actions = ['retry']
+
+    def retry(self, request, queryset):
+        count = queryset.update(status=models.IndexQueueEntry.PENDING,
+            attempts=0, next_attempt=datetime.datetime.now())
+        self.message_user(request, "%d documents queued for indexing again." %
+            count)
+    retry.short_description = "Retry indexing the selected documents"
+
+django.contrib.admin.site.register(models.IndexQueueEntry,
+    IndexQueueEntryAdmin)
+
+class OutgoingEmailAdmin(django.contrib.admin.ModelAdmin):
+    list_display = ('recipient', 'subject', 'status', 'attempts',
+        'next_attempt', 'created')
+    list_filter = ('status',)
+    readonly_fields = ('last_error',)
+    actions = ['retry']
+
+    def retry(self, request, queryset):
+        count = queryset.update(status=models.OutgoingEmail.PENDING,
+            attempts=0, next_attempt=datetime.datetime.now())
+        self.message_user(request, "%d emails queued for sending again." %
+            count)
+    retry.short_description = "Retry sending the selected emails"
+
+django.contrib.admin.site.register(models.OutgoingEmail, OutgoingEmailAdmin)
@@ -0,0 +1,116 @@
+"""
+Prefix search on users and programs for the autocomplete widgets in
+DocumentForm, so that the form doesn't have to list them all.
+
+Each page of results is cached for settings.DOCUMENTS_AUTOCOMPLETE_CACHE_TIMEOUT
+seconds (300 by default). Creating, renaming or deleting a user or
+program changes the version number in the cache keys of that source, so
+stale results are never served.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import signals
+
+from binder.models import IntranetUser, Program
+from models import Document, will_change
+
+PAGE_SIZE = 20
+
+class Source(object):
+    """
+    Something to search: the objects in a queryset, by prefix of one
+    field, which is also their label.
+    """
+
+    def __init__(self, name, model, queryset, field):
+        self.name = name
+        self.model = model
+        self.queryset = queryset
+        self.field = field
+
+    def get_version_key(self):
+        return 'documents.autocomplete.%s.version' % self.name
+
+    def get_version(self):
+        version = cache.get(self.get_version_key())
+
+        if version is None:
+            # not 1, in case pages cached under an earlier version 1
+            # outlived the version number
+            version = int(time.time())
+            cache.add(self.get_version_key(), version)
+            version = cache.get(self.get_version_key(), version)
+
+        return version
+
+    def invalidate(self, **kwargs):
+        try:
+            cache.incr(self.get_version_key())
+        except ValueError:
+            # not in the cache, so nothing cached under it either
+            pass
+
+    def get_changed_attr(self):
+        return '_autocomplete_%s_changed' % self.name
+
+    def check_label(self, instance, **kwargs):
+        setattr(instance, self.get_changed_attr(),
+            will_change(instance, [self.field]))
+
+    def saved(self, instance, **kwargs):
+        # not when a user logs in, for example, which saves last_login
+        if instance.__dict__.pop(self.get_changed_attr(), True):
+            self.invalidate()
+
+    def search(self, query, page=1):
+        """
+        Return a tuple of (results, more) where results is a list of
+        (id, label) tuples for one page of objects whose field starts
+        with query, and more is True if there are more pages.
+        """
+
+        query = query.strip()
+        key = 'documents.autocomplete.%s.%s.%s.%d' % (self.name,
+            self.get_version(),
+            hashlib.md5(query.lower().encode('utf-8')).hexdigest(), page)
+        cached = cache.get(key)
+
+        if cached is not None:
+            return cached
+
+        queryset = self.queryset()
+        if query:
+            queryset = queryset.filter(**{self.field + '__istartswith':
+                query})
+
+        start = (page - 1) * PAGE_SIZE
+        # one extra, to find out if there's another page
+        rows = list(queryset.order_by(self.field).values_list('pk',
+            self.field)[start:start + PAGE_SIZE + 1])
+        value = (rows[:PAGE_SIZE], len(rows) > PAGE_SIZE)
+
+        cache.set(key, value,
+            getattr(settings, 'DOCUMENTS_AUTOCOMPLETE_CACHE_TIMEOUT', 300))
+        return value
+
+def get_authors():
+    field = Document.authors.field
+    return field.rel.to._default_manager.complex_filter(
+        field.rel.limit_choices_to)
+
+sources = {
+    'authors': Source('authors', IntranetUser, get_authors, 'full_name'),
+    'programs': Source('programs', Program, Program.objects.all, 'name'),
+}
+
+for source in sources.values():
+    signals.pre_save.connect(source.check_label, sender=source.model,
+        dispatch_uid="documents_autocomplete_%s_saving" % source.name)
+    signals.post_save.connect(source.saved, sender=source.model,
+        dispatch_uid="documents_autocomplete_%s_saved" % source.name)
+    signals.post_delete.connect(source.invalidate, sender=source.model,
+        dispatch_uid="documents_autocomplete_%s_deleted" % source.name)
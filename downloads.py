@@ -0,0 +1,167 @@
+"""
+Serving document files to users who may see them.
+
+The file is either handed to the front-end web server, which is much
+better at sending files than Django is, by setting
+settings.DOCUMENTS_DOWNLOAD_METHOD to:
+
+* 'x-sendfile', for Apache's mod_xsendfile or lighttpd, which are given
+  the full path of the file;
+* 'x-accel-redirect', for nginx, which is given the path of the file
+  relative to MEDIA_ROOT, after settings.DOCUMENTS_DOWNLOAD_ACCEL_PREFIX
+  ('/protected/' by default), which must be an internal location
+  aliased to MEDIA_ROOT;
+
+or streamed by Django in chunks (the default, None), supporting single
+HTTP byte ranges, so that interrupted downloads of large files can be
+resumed, and ETags, so that unchanged files are not downloaded again.
+"""
+
+import mimetypes
+import os.path
+import re
+import unicodedata
+import urllib
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.encoding import force_unicode
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def get_etag(document, path):
+    if document.file_digest:
+        return '"%s"' % document.file_digest
+
+    stat = os.stat(path)
+    return '"%x-%x"' % (stat.st_size, int(stat.st_mtime))
+
+def get_content_disposition(name):
+    """
+    Return a Content-Disposition header that saves the file as name (a
+    unicode string): the name encoded as in RFC 5987 for browsers that
+    understand it, and an ASCII approximation for those that don't.
+    """
+
+    def to_ascii(value):
+        value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore')
+        return re.sub(r'[^ -~]|["\\]', '', value).strip()
+
+    (base, extension) = os.path.splitext(name)
+    ascii_name = (to_ascii(base) or 'document') + to_ascii(extension)
+
+    return 'attachment; filename="%s"; filename*=UTF-8\'\'%s' % \
+        (ascii_name, urllib.quote(name.encode('utf-8'), safe=''))
+
+def parse_range(header, size):
+    """
+    Return a tuple of (start, end), inclusive, for a single byte range
+    in a Range header, None if there is no usable range (which means the
+    whole file should be sent), or False if the range can't be satisfied.
+    """
+
+    match = RANGE_RE.match(header or '')
+    if not match or match.group(1) == match.group(2) == '':
+        # we don't do multiple ranges, the whole file will do
+        return None
+
+    if size == 0:
+        # no range of an empty file can be satisfied
+        return False
+
+    (first, last) = match.groups()
+
+    if first == '':
+        # the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return (max(size - length, 0), size - 1)
+
+    start = int(first)
+    end = int(last) if last else size - 1
+
+    if start >= size or end < start:
+        return False
+
+    return (start, min(end, size - 1))
+
+def read_file(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def serve(request, document):
+    """
+    Return a response that sends the document's file to the user, who
+    must already have been checked to be allowed to see the document.
+    """
+
+    path = document.file.path
+    # Files are stored by digest (see storage.py), so name the download
+    # after the document instead.
+    name = re.sub(r'[\\/"]', '', force_unicode(document.title) or
+        u'document') + os.path.splitext(document.file.name)[1]
+    content_type = mimetypes.guess_type(name)[0] or \
+        'application/octet-stream'
+    method = getattr(settings, 'DOCUMENTS_DOWNLOAD_METHOD', None)
+
+    if method == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+    elif method == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = urllib.quote(getattr(settings,
+            'DOCUMENTS_DOWNLOAD_ACCEL_PREFIX', '/protected/') +
+            document.file.name.encode('utf-8'))
+    else:
+        response = stream(request, document, path, content_type)
+
+    response['Content-Disposition'] = get_content_disposition(name)
+    return response
+
+def stream(request, document, path, content_type):
+    """
+    Stream the document's file, at path, from Django, handling
+    If-None-Match and Range requests.
+    """
+
+    size = os.path.getsize(path)
+    etag = get_etag(document, path)
+
+    if etag in [tag.strip() for tag in
+        request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    if request.META.get('HTTP_IF_RANGE', etag) == etag:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+
+    if byte_range is None:
+        (start, end) = (0, size - 1)
+        response = HttpResponse(read_file(path, 0, size),
+            content_type=content_type)
+    else:
+        (start, end) = byte_range
+        response = HttpResponse(read_file(path, start, end - start + 1),
+            content_type=content_type, status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+
+    response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    return response
@@ -0,0 +1,152 @@
+"""
+A persistent cache of the text extracted from document files, keyed by
+the SHA-256 digest of the file's contents and the version of Tika that
+extracted it, so that the same bytes are only sent to Tika once, however
+many times they are validated, saved, reindexed or uploaded.
+"""
+
+import hashlib
+
+from django.db.models import F
+from django.utils.encoding import force_unicode
+
+from extractors import ExtractionLimitExceeded
+from models import ExtractedText
+
+# Counts of cache hits and misses in this process, for reporting by
+# long-running commands such as rebuild_index. The persistent total is
+# kept in ExtractedText.hits.
+stats = {'hits': 0, 'misses': 0}
+
+def file_digest(file_object, chunk_size=64 * 1024):
+    """
+    Return the SHA-256 hex digest of the contents of an open file,
+    reading it in chunks, and leave it rewound to the start.
+    """
+
+    digest = hashlib.sha256()
+    file_object.seek(0)
+
+    while True:
+        chunk = file_object.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+
+    file_object.seek(0)
+    return digest.hexdigest()
+
+def get_cached_text(digest, extractor_versions, unknown_extractors=()):
+    """
+    Return the text extracted from the file with this digest by the first
+    of extractor_versions that we have in the cache, or None.
+
+    For unknown_extractors, whose current version we couldn't find out
+    (usually because the Tika server is down), the text extracted by the
+    newest version of them that we have will do.
+    """
+
+    cached = dict((c.extractor_version, c) for c in
+        ExtractedText.objects.filter(digest=digest,
+            extractor_version__in=extractor_versions))
+
+    for version in extractor_versions:
+        if version in cached:
+            stats['hits'] += 1
+            ExtractedText.objects.filter(pk=cached[version].pk).update(
+                hits=F('hits') + 1)
+            return cached[version].text
+
+    for extractor in unknown_extractors:
+        latest = ExtractedText.objects.filter(digest=digest,
+            extractor_version__startswith='%s-' % extractor.name). \
+            order_by('-created')[:1]
+
+        if latest:
+            stats['hits'] += 1
+            ExtractedText.objects.filter(pk=latest[0].pk).update(
+                hits=F('hits') + 1)
+            return latest[0].text
+
+    stats['misses'] += 1
+    return None
+
+def store_text(digest, extractor_version, text):
+    # get_or_create() copes with another process having extracted the
+    # same file at the same time: its copy is as good as ours.
+    ExtractedText.objects.get_or_create(digest=digest,
+        extractor_version=extractor_version,
+        defaults={'text': force_unicode(text)})
+
+def get_versions(extractors, errors, retry=True):
+    """
+    Return a list of (extractor, version) for those extractors that are
+    available, adding the exceptions raised by the rest to errors.
+    """
+
+    available = []
+
+    for extractor in extractors:
+        try:
+            # may need to ask the Tika server, which might be down
+            available.append((extractor, extractor.get_version(retry)))
+        except Exception as e:
+            errors.append(e)
+
+    return available
+
+def get_cached_text_for(digest, extractors):
+    """
+    Return the cached text of the file with this digest, as extracted by
+    the current version of any of the extractors, or None. This is only
+    a lookup, so it doesn't retry connecting to Tika if it's down.
+    """
+
+    available = dict(get_versions(extractors, [], retry=False))
+    return get_cached_text(digest,
+        [available[e] for e in extractors if e in available],
+        [e for e in extractors if e not in available])
+
+def get_or_extract_text(file_object, original_name, extractors, digest=None):
+    """
+    Return the text of file_object from the cache if we have already
+    extracted it with the current version of any of the extractors (see
+    extractors.py), otherwise try each of them in turn, and remember the
+    result of the first that succeeds.
+
+    If they all fail, the exception raised by the first is raised again,
+    unless any of them exceeded its limits, in which case that
+    ExtractionLimitExceeded is raised so that the document can still be
+    indexed without its text.
+    """
+
+    if digest is None:
+        digest = file_digest(file_object)
+
+    errors = []
+    available = get_versions(extractors, errors)
+
+    versions = dict(available)
+    text = get_cached_text(digest, [version for e, version in available],
+        [e for e in extractors if e not in versions])
+    if text is not None:
+        return text
+
+    for extractor, version in available:
+        try:
+            text = force_unicode(extractor.timed_extract(file_object,
+                original_name))
+        except Exception as e:
+            errors.append(e)
+            continue
+
+        store_text(digest, version, text)
+        return text
+
+    for e in errors:
+        if isinstance(e, ExtractionLimitExceeded):
+            raise e
+
+    if errors:
+        raise errors[0]
+    raise Exception("No way to extract text from %s" % original_name)
@@ -0,0 +1,383 @@
+"""
+The ways we know to extract text from document files: the Tika server,
+and local command-line tools registered by file extension or MIME type.
+
+By default (settings.DOCUMENTS_EXTRACTION_STRATEGY = 'tika') every file
+goes to Tika, and a local tool is only used if Tika fails, for example
+because it's down. With the 'fastest' strategy, the local tool and Tika
+are tried in order of their measured average latency, so that plain
+formats that a tool can convert quickly skip the HTTP round trip.
+
+Local tools run in a bounded pool of at most
+settings.DOCUMENTS_EXTRACTOR_PROCESSES subprocesses at once.
+
+Every extraction is subject to the limits in DEFAULT_LIMITS, which can be
+changed for all extractors with settings.DOCUMENTS_EXTRACTION_LIMITS, and
+for individual ones with settings.DOCUMENTS_EXTRACTOR_LIMITS, a dict of
+limits keyed by extractor name (e.g. 'tika' or 'pdftotext'). Output over
+the limit is truncated; running out of time, CPU or memory raises
+ExtractionLimitExceeded.
+"""
+
+import mimetypes
+import os.path
+import re
+import resource
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+from abc import ABCMeta, abstractmethod
+from distutils.spawn import find_executable
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, \
+    InMemoryUploadedFile
+
+import tika_client
+
+DEFAULT_LIMITS = {
+    # seconds from start to finish
+    'wall_clock': 60,
+    # seconds of CPU time, for local tools only
+    'cpu': 30,
+    # bytes of address space, for local tools only
+    'memory': 1024 * 1024 * 1024,
+    # bytes of extracted text, defaults to settings.TIKA_MAX_TEXT_SIZE
+    'output': None,
+}
+
+def get_limits(name=None):
+    limits = dict(DEFAULT_LIMITS, output=tika_client.get_max_text_size())
+    limits.update(getattr(settings, 'DOCUMENTS_EXTRACTION_LIMITS', {}))
+    limits.update(getattr(settings, 'DOCUMENTS_EXTRACTOR_LIMITS',
+        {}).get(name, {}))
+    return limits
+
+class ExtractionLimitExceeded(Exception):
+    """
+    Raised when extracting the text of a file took too long or used too
+    many resources. The document can still be indexed without its text.
+    """
+
+class Extractor(object):
+    """
+    Something that can extract text from a file, and keeps track of how
+    long it takes to do so, as an exponentially weighted moving average.
+    """
+
+    __metaclass__ = ABCMeta
+
+    name = None
+    # weight of the latest measurement in the average latency
+    smoothing = 0.2
+
+    def __init__(self):
+        self.latency = None
+
+    def is_available(self):
+        return True
+
+    def get_version(self, retry=True):
+        return self.name
+
+    @abstractmethod
+    def extract(self, file, original_name):
+        """
+        Return the text of an open file, as a UTF-8 string.
+        """
+
+    def record_latency(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.smoothing * (seconds - self.latency)
+
+    def timed_extract(self, file, original_name):
+        start = time.time()
+
+        try:
+            text = self.extract(file, original_name)
+        except Exception:
+            # Failures count as very slow, to steer us towards any
+            # alternative for a while.
+            self.record_latency(max(time.time() - start,
+                self.get_limits()['wall_clock']))
+            raise
+
+        self.record_latency(time.time() - start)
+        return text
+
+    def get_limits(self):
+        return get_limits(self.name)
+
+class TikaExtractor(Extractor):
+    name = 'tika'
+
+    def get_version(self, retry=True):
+        return 'tika-%s' % tika_client.get_version(retry)
+
+    def extract(self, file, original_name):
+        limits = self.get_limits()
+
+        try:
+            return tika_client.extract_text(file, limits['output'],
+                limits['wall_clock'])
+        except socket.timeout as e:
+            raise ExtractionLimitExceeded('Tika failed to extract %s ' \
+                'within %s seconds: %s' % (original_name,
+                    limits['wall_clock'], e))
+
+class PlainTextExtractor(Extractor):
+    name = 'plain'
+
+    def extract(self, file, original_name):
+        file.seek(0)
+        return tika_client.read_limited(file, self.get_limits()['output'])[0]
+
+class ToolExtractor(Extractor):
+    """
+    Runs a command-line converter that writes the text to stdout. The
+    string '%(path)s' in the command is replaced by the path of the file,
+    which is appended if it doesn't appear.
+
+    The version_command prints the version of the tool, which is part of
+    the extractor's version, so that upgrading the tool invalidates the
+    text that the old version extracted.
+    """
+
+    def __init__(self, name, command, format_name, version_command,
+        ignored_errors=()):
+
+        super(ToolExtractor, self).__init__()
+        self.name = name
+        self.command = command
+        self.format_name = format_name
+        self.version_command = version_command
+        self.ignored_errors = ignored_errors
+        self._version = None
+
+    def is_available(self):
+        return find_executable(self.command[0]) is not None
+
+    def get_version(self, retry=True):
+        if self._version is None:
+            # some tools print their version to stderr, some to stdout
+            process = safe_popen(list(self.version_command),
+                stderr=subprocess.STDOUT)
+            output = process.communicate()[0].strip()
+            match = re.search(r'\d+(\.\d+)+', output)
+
+            if match:
+                self._version = match.group(0)
+            elif output:
+                self._version = output.splitlines()[0]
+            else:
+                raise Exception("%s printed no version" %
+                    ' '.join(self.version_command))
+
+        return '%s-%s' % (self.name, self._version)
+
+    def extract(self, file, original_name):
+        return extract_text_using_tool(file, self.command, self.format_name,
+            original_name, limits=self.get_limits(),
+            ignored_errors=self.ignored_errors)
+
+tika = TikaExtractor()
+
+# Local extractors keyed by lower-case file extension or MIME type.
+registry = {}
+
+def register(extractor, *keys):
+    for key in keys:
+        registry[key.lower()] = extractor
+
+register(PlainTextExtractor(), '.txt', '.csv', 'text/plain', 'text/csv')
+register(ToolExtractor('pdftotext',
+    ['pdftotext', '-q', '-enc', 'UTF-8', '%(path)s', '-'], 'PDF',
+    ['pdftotext', '-v']), '.pdf', 'application/pdf')
+register(ToolExtractor('catdoc', ['catdoc', '-d', 'utf-8'], 'Word',
+    ['catdoc', '-V']), '.doc', 'application/msword')
+register(ToolExtractor('xls2csv', ['xls2csv', '-d', 'utf-8'], 'Excel',
+    ['xls2csv', '-V']), '.xls', 'application/vnd.ms-excel')
+register(ToolExtractor('odt2txt', ['odt2txt', '--encoding=UTF-8'],
+    'OpenDocument', ['odt2txt', '--version']), '.odt',
+    'application/vnd.oasis.opendocument.text')
+
+def reset_latency():
+    """
+    Forget the measured latency of all extractors, for example between
+    tests that depend on the order in which they are tried.
+    """
+
+    for extractor in [tika] + registry.values():
+        extractor.latency = None
+
+def get_local_extractor(original_name):
+    extension = os.path.splitext(original_name)[1].lower()
+    mime_type = mimetypes.guess_type(original_name)[0]
+
+    for key in (extension, mime_type):
+        extractor = registry.get(key)
+        if extractor is not None and extractor.is_available():
+            return extractor
+
+    return None
+
+def choose(original_name):
+    """
+    Return the extractors to try for a file, in order of preference.
+    """
+
+    local = get_local_extractor(original_name)
+
+    if local is None:
+        return [tika]
+
+    strategy = getattr(settings, 'DOCUMENTS_EXTRACTION_STRATEGY', 'tika')
+
+    if strategy == 'fastest':
+        # Try anything that hasn't been measured yet first, so that we
+        # find out how fast it is.
+        if (local.latency or 0) <= (tika.latency or 0):
+            return [local, tika]
+
+    return [tika, local]
+
+_processes = None
+
+def get_process_semaphore():
+    global _processes
+
+    if _processes is None:
+        _processes = threading.BoundedSemaphore(
+            getattr(settings, 'DOCUMENTS_EXTRACTOR_PROCESSES', 4))
+
+    return _processes
+
+def safe_popen(cmd_with_args, *additional_args, **popen_args):
+    cmd_with_args.extend(additional_args)
+    popen_args.setdefault('stdout', subprocess.PIPE)
+    popen_args.setdefault('stderr', subprocess.PIPE)
+
+    try:
+        return subprocess.Popen(cmd_with_args, **popen_args)
+    except (OSError, IOError) as e:
+        raise Exception('%s: %s' % (cmd_with_args, e))
+
+def get_resource_limiter(limits):
+    """
+    Return a function to apply the CPU and memory limits to a child
+    process before it runs the tool.
+    """
+
+    def limit_resources():
+        if limits.get('cpu'):
+            resource.setrlimit(resource.RLIMIT_CPU,
+                (limits['cpu'], limits['cpu']))
+
+        if limits.get('memory'):
+            resource.setrlimit(resource.RLIMIT_AS,
+                (limits['memory'], limits['memory']))
+
+    return limit_resources
+
+def ensure_saved(file):
+    """This may create a temporary file, which will be deleted when
+    it's closed, so always close() it but only when you've finished!"""
+
+    if isinstance(file, InMemoryUploadedFile):
+        tmp = TemporaryUploadedFile(name=file.name,
+            content_type=file.content_type, size=file.size,
+            charset=file.charset)
+        file.seek(0)
+        for chunk in file.chunks():
+            tmp.write(chunk)
+        tmp.flush()
+    else:
+        tmp = file
+
+    if isinstance(tmp, TemporaryUploadedFile):
+        path = tmp.temporary_file_path()
+    else:
+        path = tmp.name
+
+    return (tmp, path)
+
+def extract_text_using_tool(file, tool, format_name, original_name,
+    limits=None, ignored_errors=()):
+
+    if limits is None:
+        limits = get_limits()
+
+    (tmp, path) = ensure_saved(file)
+
+    if '%(path)s' in tool:
+        command = [arg % {'path': path} for arg in tool]
+    else:
+        command = list(tool) + [path]
+
+    # stderr goes to a file, so that we can read stdout without the tool
+    # blocking on a full stderr pipe
+    errors = tempfile.TemporaryFile()
+    semaphore = get_process_semaphore()
+    semaphore.acquire()
+
+    try:
+        try:
+            process = safe_popen(command, stderr=errors,
+                preexec_fn=get_resource_limiter(limits))
+        except Exception as e:
+            raise Exception('Failed to convert %s document: %s' %
+                (format_name, e))
+
+        timed_out = []
+
+        def kill():
+            timed_out.append(True)
+            process.kill()
+
+        timer = None
+        if limits.get('wall_clock'):
+            timer = threading.Timer(limits['wall_clock'], kill)
+            timer.start()
+
+        try:
+            (out, truncated) = tika_client.read_limited(process.stdout,
+                limits.get('output'))
+            if truncated:
+                # don't let it keep writing, we have enough
+                process.kill()
+            process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if timed_out:
+            raise ExtractionLimitExceeded('Failed to convert %s document ' \
+                '%s: timed out after %s seconds' % (format_name,
+                    original_name, limits['wall_clock']))
+
+        if truncated:
+            return out
+
+        if process.returncode < 0:
+            raise ExtractionLimitExceeded('Failed to convert %s document ' \
+                '%s: killed by signal %d, probably for exceeding its CPU ' \
+                'or memory limit' % (format_name, original_name,
+                    -process.returncode))
+
+        errors.seek(0)
+        err = errors.read()
+        if err != '' and err not in ignored_errors:
+            raise Exception('Failed to convert %s document: %s' %
+                (format_name, err))
+    finally:
+        semaphore.release()
+        errors.close()
+        if tmp is not file:
+            tmp.close()
+
+    return out
@@ -1,3 +1,4 @@
+from django.core.files.uploadedfile import UploadedFile
 from django.core.validators import EMPTY_VALUES
 from django.forms import ModelForm
 from django.forms.util import ErrorList
@@ -6,13 +7,14 @@ from binder.admin import TemplatedModelMultipleChoiceField
 from binder.widgets import AdminYesNoWidget, AdminFileWidgetWithSize
 
 from models import Document
+from storage import document_storage
+from widgets import AutocompleteSelectMultiple
 
 class DocumentForm(ModelForm):
-    MULTIPLE_SELECT_HELP = u'Hold down Ctrl to select multiple options'
-    
     authors = TemplatedModelMultipleChoiceField(
         queryset=Document.authors.field.rel.to._default_manager.complex_filter(Document.authors.field.rel.limit_choices_to),
-        template='{{ obj.full_name }}')
+        template='{{ obj.full_name }}',
+        widget=AutocompleteSelectMultiple('authors'))
     
     class Meta:
         model = Document
@@ -35,12 +37,14 @@ class DocumentForm(ModelForm):
         # allowing the document to be saved.
         self.fields['title'].required = False
         
-        self.fields['document_type'].queryset.order_by('name')
-        self.fields['programs'].help_text = self.MULTIPLE_SELECT_HELP
-        self.fields['programs'].queryset.order_by('name')
+        self.fields['document_type'].queryset = \
+            self.fields['document_type'].queryset.order_by('name')
+        self.fields['programs'].widget = AutocompleteSelectMultiple('programs')
+        self.fields['programs'].queryset = \
+            self.fields['programs'].queryset.order_by('name')
         self.fields['authors'].required = False
-        self.fields['authors'].help_text = self.MULTIPLE_SELECT_HELP
-        self.fields['authors'].queryset.order_by('full_name')
+        self.fields['authors'].queryset = \
+            self.fields['authors'].queryset.order_by('full_name')
         self.fields['confidential'].widget = AdminYesNoWidget()
         self.fields['uploader'].required = False
         self.fields['file'].widget = AdminFileWidgetWithSize()
@@ -52,10 +56,14 @@ class DocumentForm(ModelForm):
         
         If the authors are not set, set the author to the current logged-in
         user.
+
+        If a new file is uploaded, find any other documents with the same
+        file, to warn the user about in DocumentAdmin.
         """
         
         cleaned_data = super(DocumentForm, self).clean()
-        
+        self.duplicates = []
+
         if (cleaned_data['title'] in EMPTY_VALUES and
             cleaned_data.get('file', None) is not None):
             import re
@@ -66,4 +74,21 @@ class DocumentForm(ModelForm):
             else:
                 cleaned_data['title'] = cleaned_data['file'].name
 
+        uploaded = cleaned_data.get('file', None)
+        if isinstance(uploaded, UploadedFile):
+            # Store it now, to get the digest that document_storage
+            # calculates as it writes the file, instead of reading the
+            # upload twice. If the document is never saved, the file is
+            # left for the delete_unused_files command.
+            self.instance.file.save(uploaded.name, uploaded, save=False)
+            cleaned_data['file'] = self.instance.file.name
+            digest = document_storage.get_digest(self.instance.file.name)
+            self.instance.file_digest = digest
+            self.instance._digest_of = self.instance.file.name
+            duplicates = Document.objects.filter(file_digest=digest,
+                deleted=False)
+            if self.instance.pk is not None:
+                duplicates = duplicates.exclude(pk=self.instance.pk)
+            self.duplicates = list(duplicates[:5])
+
         return cleaned_data
@@ -0,0 +1,184 @@
+"""
+Queued indexing of documents, as an alternative to extracting their text
+and updating the search index in the request thread whenever they are
+saved.
+
+When settings.DOCUMENTS_QUEUED_INDEXING is True, DocumentIndex records an
+IndexQueueEntry instead of indexing the document, and the
+process_index_queue command works through the queue in batches. Entries
+that fail are retried with exponential backoff, and after too many
+attempts are left in the FAILED state (a dead letter) for someone to
+look at in the admin.
+"""
+
+import datetime
+import traceback
+
+from django.conf import settings
+from django.db import connection
+
+from haystack import connections, connection_router
+from haystack.utils import get_identifier
+
+from models import Document, IndexQueueEntry
+from retries import record_failure
+
+def is_enabled():
+    return getattr(settings, 'DOCUMENTS_QUEUED_INDEXING', False)
+
+def enqueue(document_id, action=IndexQueueEntry.UPDATE):
+    """
+    Ask for a document to be reindexed (or removed from the index) by the
+    next run of process_index_queue. At most one entry per document is
+    kept pending, with the most recently requested action.
+    """
+
+    updated = IndexQueueEntry.objects.filter(document_id=document_id,
+        status=IndexQueueEntry.PENDING).update(action=action)
+
+    if not updated:
+        IndexQueueEntry.objects.create(document_id=document_id,
+            action=action)
+
+def get_backlog_count():
+    return IndexQueueEntry.objects.filter(status__in=(IndexQueueEntry.PENDING,
+        IndexQueueEntry.PROCESSING)).count()
+
+def get_failed_count():
+    return IndexQueueEntry.objects.filter(
+        status=IndexQueueEntry.FAILED).count()
+
+def claim_batch(batch_size):
+    """
+    Take up to batch_size pending entries that are due, marking them as
+    PROCESSING so that other workers running at the same time leave them
+    alone.
+    """
+
+    candidates = IndexQueueEntry.objects.filter(
+        status=IndexQueueEntry.PENDING,
+        next_attempt__lte=datetime.datetime.now()).values_list('pk',
+        flat=True)[:batch_size]
+
+    claimed = [pk for pk in candidates
+        if IndexQueueEntry.objects.filter(pk=pk,
+            status=IndexQueueEntry.PENDING).update(
+            status=IndexQueueEntry.PROCESSING)]
+
+    return list(IndexQueueEntry.objects.filter(pk__in=claimed))
+
+def release_stale(seconds):
+    """
+    Return entries that have been PROCESSING for more than the given
+    number of seconds, presumably by a worker that crashed, to the queue.
+    """
+
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+    return IndexQueueEntry.objects.filter(status=IndexQueueEntry.PROCESSING,
+        modified__lt=cutoff).update(status=IndexQueueEntry.PENDING)
+
+def get_backends():
+    return [connections[using].get_backend()
+        for using in connection_router.for_write()]
+
+def get_index():
+    return connections['default'].get_unified_index().get_index(Document)
+
+def update_documents(document_ids):
+    """
+    Reindex several documents whose metadata has changed, for example by
+    a queryset update() that doesn't send any signals, with one request
+    to each search backend (or one queue entry each with queued
+    indexing). Their text comes from the extracted text cache, so their
+    files are not extracted again.
+    """
+
+    if is_enabled():
+        for document_id in document_ids:
+            enqueue(document_id)
+        return
+
+    index = get_index()
+    documents = list(index.index_queryset().filter(pk__in=document_ids))
+
+    if documents:
+        for backend in get_backends():
+            backend.update(index, documents)
+
+def process_batch(entries, workers=1, max_attempts=5, backoff=60):
+    """
+    Index or remove the documents for a batch of claimed entries, running
+    text extraction in a pool of worker threads, and submitting all the
+    updates to the search backend at once. Returns the number of entries
+    that failed.
+    """
+
+    index = get_index()
+    backends = get_backends()
+    documents = index.index_queryset().in_bulk([e.document_id for e in entries
+        if e.action == IndexQueueEntry.UPDATE])
+    failures = 0
+
+    # documents that no longer exist can only be removed from the index
+    updates = [e for e in entries if e.document_id in documents]
+    removes = [e for e in entries if e.document_id not in documents]
+
+    def extract(entry):
+        # Extract the text now, in parallel, and leave it on the document
+        # for full_prepare() to use when the backend indexes it.
+        document = documents[entry.document_id]
+        try:
+            document._validated_text = index.prepare_text(document)
+            return None
+        except Exception:
+            return traceback.format_exc()
+        finally:
+            if workers > 1:
+                # Each thread has its own database connection.
+                connection.close()
+
+    if workers > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(workers)
+        try:
+            errors = pool.map(extract, updates)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        errors = [extract(entry) for entry in updates]
+
+    extracted = []
+    for entry, error in zip(updates, errors):
+        if error is None:
+            extracted.append(entry)
+        else:
+            record_failure(entry, error, max_attempts, backoff)
+            failures += 1
+
+    try:
+        if extracted:
+            for backend in backends:
+                backend.update(index, [documents[e.document_id]
+                    for e in extracted])
+    except Exception:
+        error = traceback.format_exc()
+        for entry in extracted:
+            record_failure(entry, error, max_attempts, backoff)
+        failures += len(extracted)
+    else:
+        IndexQueueEntry.objects.filter(
+            pk__in=[e.pk for e in extracted]).delete()
+
+    for entry in removes:
+        try:
+            for backend in backends:
+                backend.remove(get_identifier(Document(pk=entry.document_id)))
+        except Exception:
+            record_failure(entry, traceback.format_exc(), max_attempts,
+                backoff)
+            failures += 1
+        else:
+            entry.delete()
+
+    return failures
@@ -1,28 +1,106 @@
 import os, os.path
 import random
+import time
+
+from optparse import make_option
+
+from django.core.management import call_command
 from django.core.management.base import NoArgsCommand, CommandError
 from django.core.files.base import File
 from documents.models import Document, DocumentType
+from documents.storage import document_storage
 from binder.models import Program, IntranetUser
 
 class Command(NoArgsCommand):
     help = 'Add thousands of documents to the Whoosh search index to stress it'
 
-    def handle_noargs(self, **options):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--count', type='int', default=12000,
+            help='Number of documents to add [default: %default]'),
+        make_option('--batch-size', type='int', default=500,
+            help='Number of documents to insert at once [default: %default]'),
+        make_option('--workers', type='int', default=None,
+            help='Number of processes extracting text while indexing ' +
+            '[default: number of CPUs]'),
+        make_option('--no-index', action='store_false', dest='index',
+            default=True,
+            help="Don't index the new documents at the end"),
+        )
+
+    def store_fixtures(self):
+        """
+        Save one copy of each fixture file in the document storage, and
+        return their names, to be shared by all the new documents.
+        """
+
         doc_dir = os.path.join(os.path.dirname(__file__), '..', '..',
             'fixtures')
-        
-        doctypes = DocumentType.objects.all()
-        programs = Program.objects.all()
-        users = IntranetUser.objects.all()
-        
-        for i in range(1000):
-            for f in os.listdir(doc_dir):
-                doc = Document()
-                doc.title = random.random()
-                doc.file = File(open(os.path.join(doc_dir, f)))
-                doc.notes = random.random()
-                doc.document_type = random.choice(doctypes)
-                doc.save()
-                doc.programs = random.sample(programs, 2)
-                doc.authors = random.sample(users, 1)
+        field = Document._meta.get_field('file')
+        names = []
+
+        for f in sorted(os.listdir(doc_dir)):
+            if f.endswith('.json'):
+                continue
+
+            with open(os.path.join(doc_dir, f), 'rb') as source:
+                names.append(field.storage.save(
+                    field.generate_filename(None, f), File(source)))
+
+        return names
+
+    def handle_noargs(self, **options):
+        doctypes = list(DocumentType.objects.all())
+        programs = list(Program.objects.all())
+        users = list(IntranetUser.objects.all())
+
+        if not doctypes or len(programs) < 2 or not users:
+            raise CommandError("Need at least one document type, two " +
+                "programs and one user to create documents")
+
+        files = self.store_fixtures()
+        run = int(time.time())
+        count = options['count']
+        size = options['batch_size']
+        verbosity = int(options.get('verbosity', 1))
+
+        programs_field = Document.programs.field
+        authors_field = Document.authors.field
+
+        def links(field, pairs):
+            through = field.rel.through
+            return [through(**{field.m2m_field_name() + '_id': id,
+                field.m2m_reverse_field_name(): obj}) for id, obj in pairs]
+
+        # bulk_create() doesn't send signals, so the documents are not
+        # validated or indexed one by one as they are inserted.
+        for start in xrange(0, count, size):
+            titles = ['Load test %d %d' % (run, i)
+                for i in xrange(start, min(start + size, count))]
+
+            # with their digests, so that indexing doesn't hash every file
+            Document.objects.bulk_create([Document(title=title,
+                file=files[i % len(files)],
+                file_digest=document_storage.get_digest(files[i % len(files)]),
+                notes=random.random(), document_type=random.choice(doctypes))
+                for i, title in enumerate(titles)])
+
+            ids = Document.objects.filter(title__in=titles). \
+                values_list('id', flat=True)
+
+            programs_field.rel.through.objects.bulk_create(
+                links(programs_field, [(id, program) for id in ids
+                    for program in random.sample(programs, 2)]))
+            authors_field.rel.through.objects.bulk_create(
+                links(authors_field, [(id, random.choice(users))
+                    for id in ids]))
+
+            if verbosity >= 1:
+                print "Added %d of %d documents" % (start + len(titles),
+                    count)
+
+        if options['index']:
+            # Each fixture is only sent to Tika once, the rest of its
+            # copies come from the extracted text cache.
+            call_command('reindex_documents', only_missing=True,
+                workers=options['workers'], batch_size=size,
+                verbosity=verbosity)
@@ -0,0 +1,57 @@
+import time
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from documents.models import Document
+from binder.models import Program
+
+class Command(NoArgsCommand):
+    help = 'Time the document queries run by the admin changelist, ' + \
+        'program filters and reports. To compare the effect of the ' + \
+        'database indexes, run it with documents migrated to 0005, ' + \
+        'then again after migrating to 0006. Seed the database first, ' + \
+        'for example with add_thousands_of_documents --count 100000.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--repeat', type='int', default=20,
+            help='Number of times to run each query [default: %default]'),
+        )
+
+    def get_queries(self):
+        live = Document.objects.filter(deleted=False)
+        program = Program.objects.all()[0]
+
+        return (
+            ('changelist page (by title)',
+                lambda: list(live.order_by('title')[:100])),
+            ('changelist count',
+                lambda: live.count()),
+            ('changelist last page (by title)',
+                lambda: list(live.order_by('title')[max(live.count() - 100,
+                    0):])),
+            ('program filter',
+                lambda: list(live.filter(programs=program)[:100])),
+            ('newest documents (by created)',
+                lambda: list(live.order_by('-created')[:100])),
+            ('documents created this year',
+                lambda: live.filter(created__year=time.localtime().tm_year
+                    ).count()),
+        )
+
+    def handle_noargs(self, **options):
+        count = Document.objects.count()
+        if not count:
+            raise CommandError("There are no documents to query. Run " +
+                "add_thousands_of_documents first.")
+
+        print "Timing queries over %d documents:" % count
+
+        for name, query in self.get_queries():
+            query() # warm up the database cache
+            start = time.time()
+            for i in xrange(options['repeat']):
+                query()
+            elapsed = (time.time() - start) / options['repeat']
+            print "  %-32s %8.2f ms" % (name, elapsed * 1000)
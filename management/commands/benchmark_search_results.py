@@ -0,0 +1,69 @@
+import time
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection
+from django.template import Context, Template
+
+from documents.search_queries import DocumentSearchQuerySet, render_results
+
+# What rendering a results table costs when every row loads its document,
+# like the search results table does through result.object.
+HYDRATED_TEMPLATE = Template("""{% for result in results %}
+<a href='{{ result.object.get_absolute_url }}'>{{ result.object.title }}</a>
+{% for author in result.object.authors.all %}{{ author.full_name }}, {% endfor %}
+{{ result.object.created|date }}
+{% for program in result.object.programs.all %}{{ program.name }}, {% endfor %}
+{{ result.object.document_type.name }}
+{{ result.object.uploader.full_name }}
+{% endfor %}""")
+
+class Command(NoArgsCommand):
+    help = 'Compare rendering a page of search results by loading each ' + \
+        'document from the database with rendering it from the fields ' + \
+        'stored in the index. Seed the index first, for example with ' + \
+        'add_thousands_of_documents.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--hits', type='int', default=50,
+            help='Number of results on the page [default: %default]'),
+        make_option('--repeat', type='int', default=20,
+            help='Number of times to render each page [default: %default]'),
+        )
+
+    def handle_noargs(self, **options):
+        hits = options['hits']
+        results = list(DocumentSearchQuerySet()[:hits])
+
+        if len(results) < hits:
+            raise CommandError("Only %d documents are indexed. Run " \
+                "add_thousands_of_documents first." % len(results))
+
+        def hydrated():
+            # fresh results, so that nothing is cached on them
+            page = list(DocumentSearchQuerySet()[:hits])
+            return HYDRATED_TEMPLATE.render(Context({'results': page}))
+
+        def stored():
+            return render_results(list(DocumentSearchQuerySet()[:hits]))
+
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+
+        try:
+            print "Rendering a page of %d search results:" % hits
+
+            for name, render in (('loading each document', hydrated),
+                ('from stored fields', stored)):
+                render() # warm up
+                connection.queries = []
+                start = time.time()
+                for i in xrange(options['repeat']):
+                    render()
+                elapsed = (time.time() - start) / options['repeat']
+                queries = len(connection.queries) / float(options['repeat'])
+                print "  %-24s %8.2f ms %6.1f queries" % (name,
+                    elapsed * 1000, queries)
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from documents.tika_client import Endpoint, TikaPool
+
+class StubTikaHandler(BaseHTTPRequestHandler):
+    """
+    Pretends to be a Tika server: "extracts" text by returning whatever
+    was PUT to it, and supports keep-alive like the real one does.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # send each response in one packet, as a real server would
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def respond(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond('Apache Tika stub')
+
+    def do_PUT(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        self.respond(self.rfile.read(length))
+
+    def log_message(self, format, *args):
+        pass
+
+class StubTikaServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class Command(NoArgsCommand):
+    help = 'Compare the throughput of pooled keep-alive connections ' + \
+        'to Tika with opening a new connection for every document, ' + \
+        'using a local stub Tika server'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--requests', type='int', default=2000,
+            help='Number of documents to send each way [default: %default]'),
+        make_option('--size', type='int', default=4096,
+            help='Size of each document in bytes [default: %default]'),
+        )
+
+    def handle_noargs(self, **options):
+        server = StubTikaServer(('127.0.0.1', 0), StubTikaHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+        body = 'x' * options['size']
+        count = options['requests']
+
+        try:
+            endpoint = Endpoint(url, pool_size=1, timeout=30)
+
+            def unpooled():
+                # what prepare_text() used to do for every document
+                conn = endpoint.connection_class(endpoint.netloc,
+                    strict=True, timeout=30)
+                conn.request('PUT', endpoint.path + '/tika', body)
+                conn.getresponse().read()
+                conn.close()
+
+            pool = TikaPool([url])
+
+            def pooled():
+                pool.request('PUT', '/tika', body)
+
+            results = []
+            for name, fn in (('new connection per document', unpooled),
+                ('pooled keep-alive connections', pooled)):
+                start = time.time()
+                for i in xrange(count):
+                    fn()
+                elapsed = time.time() - start
+                results.append(count / elapsed)
+                print "%-32s %8.1f documents/second" % (name, results[-1])
+
+            print "Speedup: %.2fx" % (results[1] / results[0])
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,57 @@
+import os
+import os.path
+import time
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from documents.models import Document
+from documents.storage import document_storage
+
+class Command(NoArgsCommand):
+    help = 'Delete stored document files that no document refers to ' + \
+        'any more, for example because the document was deleted or ' + \
+        'given a different file. Files stored before they were named ' + \
+        'by digest are never deleted.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--min-age', type='int', default=86400,
+            help='Only delete files last stored more than this many ' +
+            'seconds ago, to leave alone those of documents still being ' +
+            'saved [default: %default]'),
+        make_option('--dry-run', action='store_true', default=False,
+            help='List the files that would be deleted without ' +
+            'deleting them'),
+        )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        cutoff = time.time() - options['min_age']
+        root = document_storage.path(Document._meta.get_field('file').upload_to)
+        deleted = 0
+
+        for directory, subdirectories, filenames in os.walk(root):
+            for filename in filenames:
+                full_path = os.path.join(directory, filename)
+                name = os.path.relpath(full_path, document_storage.location)
+
+                if (document_storage.get_digest(name) is None or
+                    os.path.getmtime(full_path) > cutoff or
+                    Document.objects.filter(file=name).exists()):
+                    continue
+
+                # check again, in case it was uploaded again meanwhile
+                if os.path.getmtime(full_path) > cutoff:
+                    continue
+
+                if verbosity >= 2 or options['dry_run']:
+                    print name
+
+                if not options['dry_run']:
+                    document_storage.delete(name)
+                deleted += 1
+
+        if verbosity >= 1:
+            print "%s %d unused files" % ("Would delete" if options['dry_run']
+                else "Deleted", deleted)
@@ -0,0 +1,21 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from documents import view_cache
+
+class Command(NoArgsCommand):
+    help = 'Report the hit rate of the read-only document page cache'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--reset', action='store_true', default=False,
+            help='Reset the counters after reporting them'),
+        )
+
+    def handle_noargs(self, **options):
+        (hits, misses, rate) = view_cache.get_stats()
+        print "Hits: %d, misses: %d, hit rate: %.1f%%" % (hits, misses,
+            rate * 100)
+
+        if options['reset']:
+            view_cache.reset_stats()
@@ -0,0 +1,21 @@
+from django.core.management.base import NoArgsCommand
+from django.db.models import Count, Sum
+
+from documents.models import ExtractedText
+
+class Command(NoArgsCommand):
+    help = 'Report how much Tika extraction work the extracted text ' + \
+        'cache has saved'
+
+    def handle_noargs(self, **options):
+        totals = ExtractedText.objects.aggregate(entries=Count('id'),
+            hits=Sum('hits'))
+
+        print "Cached extractions: %d" % totals['entries']
+        print "Cache hits (extractions avoided): %d" % (totals['hits'] or 0)
+
+        for version in ExtractedText.objects.values('extractor_version'). \
+            annotate(entries=Count('id'), hits=Sum('hits')). \
+            order_by('extractor_version'):
+            print "  %(extractor_version)s: %(entries)d entries, %(hits)d hits" % \
+                version
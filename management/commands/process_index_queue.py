@@ -0,0 +1,56 @@
+import time
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from documents import indexing
+
+class Command(NoArgsCommand):
+    help = 'Index documents queued for indexing when ' + \
+        'DOCUMENTS_QUEUED_INDEXING is enabled. Several copies of this ' + \
+        'command can safely run at the same time, to use more processes.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', default=100,
+            help='Number of documents to index at once [default: %default]'),
+        make_option('--workers', type='int', default=4,
+            help='Number of threads extracting text [default: %default]'),
+        make_option('--max-attempts', type='int', default=5,
+            help='Give up on a document after this many failures ' +
+            '[default: %default]'),
+        make_option('--retry-backoff', type='int', default=60,
+            help='Seconds to wait before the first retry, doubled ' +
+            'for each one after that [default: %default]'),
+        make_option('--stale-after', type='int', default=3600,
+            help='Seconds after which a document being processed by ' +
+            'another worker is assumed lost and requeued [default: %default]'),
+        make_option('--loop', action='store_true', default=False,
+            help='Keep waiting for more documents instead of exiting ' +
+            'when the queue is empty'),
+        make_option('--sleep', type='int', default=5,
+            help='Seconds to wait for more documents with --loop ' +
+            '[default: %default]'),
+        )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        while True:
+            indexing.release_stale(options['stale_after'])
+            entries = indexing.claim_batch(options['batch_size'])
+
+            if entries:
+                failures = indexing.process_batch(entries,
+                    workers=options['workers'],
+                    max_attempts=options['max_attempts'],
+                    backoff=options['retry_backoff'])
+
+                if verbosity >= 1:
+                    print "Processed %d documents (%d failed), %d left" % \
+                        (len(entries), failures,
+                            indexing.get_backlog_count())
+            elif options['loop']:
+                time.sleep(options['sleep'])
+            else:
+                break
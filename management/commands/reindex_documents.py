@@ -0,0 +1,184 @@
+import datetime
+import functools
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection
+
+from documents import indexing, tika_client
+from documents.models import Document
+
+def init_worker():
+    # Don't share the parent's connections to Tika.
+    tika_client.reset_pool()
+
+def extract_texts(pks, retry_degraded=False):
+    """
+    Extract the text of a chunk of documents, in a worker process.
+    Returns (pks, texts, errors) where texts and errors are dicts keyed
+    by primary key.
+    """
+
+    index = indexing.get_index()
+    texts = {}
+    errors = {}
+
+    for document in Document.objects.filter(pk__in=pks):
+        document._retry_extraction = retry_degraded
+
+        try:
+            texts[document.pk] = index.prepare_text(document)
+        except Exception as e:
+            errors[document.pk] = str(e)
+
+    return (pks, texts, errors)
+
+def get_done_ranges(chunk, errors):
+    """
+    Return (first, last) ranges covering the primary keys in chunk that
+    didn't fail, so that failed documents are retried on resume.
+    """
+
+    ranges = []
+    first = None
+
+    for i, pk in enumerate(chunk):
+        if pk in errors:
+            if first is not None:
+                ranges.append((first, chunk[i - 1]))
+                first = None
+        elif first is None:
+            first = pk
+
+    if first is not None:
+        ranges.append((first, chunk[-1]))
+
+    return ranges
+
+class Command(NoArgsCommand):
+    help = 'Rebuild the search index for documents, extracting text ' + \
+        'in several processes at once'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--workers', type='int', default=None,
+            help='Number of processes extracting text [default: number ' +
+            'of CPUs]'),
+        make_option('--batch-size', type='int', default=100,
+            help='Number of documents extracted and indexed together ' +
+            '[default: %default]'),
+        make_option('--since', default=None,
+            help='Only reindex documents created on or after this date ' +
+            '(YYYY-MM-DD)'),
+        make_option('--only-missing', action='store_true', default=False,
+            help='Only index documents that are not in the index yet'),
+        make_option('--retry-degraded', action='store_true', default=False,
+            help='Try again to extract the files of documents that ' +
+            'exceeded the extraction limits before, instead of only ' +
+            'indexing their title and notes'),
+        make_option('--state-file', default=None,
+            help='Record indexed documents in this file, and skip ' +
+            'them if it already exists, to resume an interrupted run ' +
+            'and retry those that failed'),
+        )
+
+    def get_pks(self, index, options):
+        queryset = index.index_queryset()
+
+        if options['since']:
+            try:
+                since = datetime.datetime.strptime(options['since'],
+                    '%Y-%m-%d')
+            except ValueError as e:
+                raise CommandError("Invalid --since date: %s" % e)
+            queryset = queryset.filter(created__gte=since)
+
+        pks = set(queryset.values_list('pk', flat=True))
+
+        if options['only_missing']:
+            from haystack.query import SearchQuerySet
+            indexed = SearchQuerySet().models(Document)
+            # one slice of everything, rather than iterating, which
+            # fetches HAYSTACK_ITERATOR_LOAD_PER_QUERY results at a time
+            pks -= set(int(result.pk) for result in
+                indexed[:indexed.count()])
+
+        return sorted(pks)
+
+    def read_state(self, path):
+        done = []
+
+        try:
+            with open(path) as f:
+                for line in f:
+                    first, last = line.split()
+                    done.append((int(first), int(last)))
+        except IOError:
+            pass
+
+        return done
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        index = indexing.get_index()
+        backends = indexing.get_backends()
+        pks = self.get_pks(index, options)
+
+        state_file = None
+        if options['state_file']:
+            done = self.read_state(options['state_file'])
+            pks = [pk for pk in pks if not any(first <= pk <= last
+                for first, last in done)]
+            state_file = open(options['state_file'], 'a')
+
+        size = options['batch_size']
+        chunks = [pks[i:i + size] for i in xrange(0, len(pks), size)]
+
+        extract = functools.partial(extract_texts,
+            retry_degraded=options['retry_degraded'])
+
+        if options['workers'] == 1:
+            results = (extract(chunk) for chunk in chunks)
+            pool = None
+        else:
+            from multiprocessing import Pool
+            # Each worker must open its own database connection.
+            connection.close()
+            pool = Pool(options['workers'], init_worker)
+            results = pool.imap_unordered(extract, chunks)
+
+        indexed = 0
+        failed = 0
+
+        try:
+            for chunk, texts, errors in results:
+                documents = list(index.index_queryset().filter(
+                    pk__in=texts.keys()))
+                for document in documents:
+                    document._validated_text = texts[document.pk]
+
+                for backend in backends:
+                    backend.update(index, documents)
+
+                if state_file:
+                    for first, last in get_done_ranges(chunk, errors):
+                        state_file.write("%d %d\n" % (first, last))
+                    state_file.flush()
+
+                indexed += len(documents)
+                failed += len(errors)
+
+                if verbosity >= 2:
+                    for pk, error in errors.iteritems():
+                        print "Failed to extract document %d: %s" % \
+                            (pk, error)
+
+                if verbosity >= 1:
+                    print "Indexed %d of %d documents (%d failed)" % \
+                        (indexed, len(pks), failed)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if state_file:
+                state_file.close()
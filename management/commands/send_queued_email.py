@@ -0,0 +1,54 @@
+import time
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from documents import notifications
+
+class Command(NoArgsCommand):
+    help = 'Send notification emails queued when DOCUMENTS_QUEUED_EMAIL ' + \
+        'is enabled, reusing one connection to the mail server for ' + \
+        'each batch'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', default=100,
+            help='Number of emails to send over one connection ' +
+            '[default: %default]'),
+        make_option('--max-attempts', type='int', default=5,
+            help='Give up on an email after this many failures ' +
+            '[default: %default]'),
+        make_option('--retry-backoff', type='int', default=60,
+            help='Seconds to wait before the first retry, doubled ' +
+            'for each one after that [default: %default]'),
+        make_option('--stale-after', type='int', default=3600,
+            help='Seconds after which an email being sent by another ' +
+            'sender is assumed lost and requeued [default: %default]'),
+        make_option('--loop', action='store_true', default=False,
+            help='Keep waiting for more emails instead of exiting ' +
+            'when none are due'),
+        make_option('--sleep', type='int', default=5,
+            help='Seconds to wait for more emails with --loop ' +
+            '[default: %default]'),
+        )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        while True:
+            notifications.release_stale(options['stale_after'])
+            entries = notifications.claim_batch(options['batch_size'])
+
+            if entries:
+                failures = notifications.send_batch(entries,
+                    max_attempts=options['max_attempts'],
+                    backoff=options['retry_backoff'])
+
+                if verbosity >= 1:
+                    print "Sent %d emails (%d failed), %d left" % \
+                        (len(entries), failures,
+                            notifications.get_backlog_count())
+            elif options['loop']:
+                time.sleep(options['sleep'])
+            else:
+                break
@@ -0,0 +1,44 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from documents import text_pipeline
+from documents.models import ExtractedText
+
+class Command(NoArgsCommand):
+    help = 'Report how much the text pipeline shrinks the text in the ' + \
+        'extracted text cache, stage by stage'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--stages', default=None,
+            help='Comma-separated stages to run, instead of ' +
+            'DOCUMENTS_TEXT_PIPELINE, from: %s' %
+            ', '.join(sorted(text_pipeline.STAGES))),
+        )
+
+    def handle_noargs(self, **options):
+        if options['stages']:
+            pipeline = options['stages'].split(',')
+            unknown = set(pipeline) - set(text_pipeline.STAGES)
+            if unknown:
+                raise CommandError("Unknown stages: %s" %
+                    ', '.join(sorted(unknown)))
+        else:
+            pipeline = text_pipeline.get_pipeline()
+
+        counts = {}
+        size_before = size_after = 0
+
+        for text in ExtractedText.objects.values_list('text',
+            flat=True).iterator():
+            size_before += len(text)
+            size_after += len(text_pipeline.process(text, pipeline, counts))
+
+        print "Texts: %d" % counts.get('documents', 0)
+        print "Characters before: %d, after: %d (%.1f%% saved)" % \
+            (size_before, size_after,
+                100.0 * (size_before - size_after) / (size_before or 1))
+
+        for name in pipeline:
+            print "  %-24s %d characters removed" % (name,
+                counts.get(name, 0))
@@ -1,8 +1,12 @@
+import datetime
+
 import binder.configurable
 import django.dispatch
 
 from django.db import models
 
+from storage import document_storage
+
 # http://djangosnippets.org/snippets/1054/
 
 class DocumentType(models.Model):
@@ -19,15 +23,18 @@ class Document(models.Model):
         permissions = (
             ('view_document', "Can view documents using read-only form"),
             )
+        # Migration 0006 also adds composite indexes on (deleted, title)
+        # and (deleted, created), which Django can't declare here.
     
     title = models.CharField(max_length=255, unique=True)
     document_type = models.ForeignKey(DocumentType)
-    file = models.FileField(upload_to='documents', blank=True)
+    file = models.FileField(upload_to='documents', blank=True,
+        storage=document_storage)
     notes = models.TextField(verbose_name="Description")
     authors = models.ManyToManyField(binder.configurable.UserModel,
         related_name="documents_authored")
     external_authors = models.CharField(max_length=255, blank=True)
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
 
     try:
         hyperlink = models.URLField(blank=True, verify_exists=False)
@@ -39,11 +46,86 @@ class Document(models.Model):
     confidential = models.BooleanField("CONFIDENTIAL DO NOT SHARE OUTSIDE ATA")
     deleted = models.BooleanField()
 
+    EXTRACTION_OK = 'ok'
+    EXTRACTION_DEGRADED = 'degraded'
+    EXTRACTION_STATUS_CHOICES = (
+        (EXTRACTION_OK, 'OK'),
+        (EXTRACTION_DEGRADED, 'Degraded: file contents are not searchable'),
+    )
+    extraction_status = models.CharField(max_length=10,
+        choices=EXTRACTION_STATUS_CHOICES, default=EXTRACTION_OK)
+    # SHA-256 of the contents of file, if known, to find its text in the
+    # ExtractedText cache without reading it again, and duplicate files
+    file_digest = models.CharField(max_length=64, blank=True, db_index=True)
+
     on_validate = django.dispatch.Signal(providing_args=['instance'])    
     
     def __unicode__(self):
         return "Document<%s>" % self.title
+
+    def get_field_values(self):
+        values = {}
+        for field in self._meta.fields:
+            value = getattr(self, field.attname)
+            if isinstance(value, models.fields.files.FieldFile):
+                value = value.name
+            values[field.attname] = value
+        return values
+
+    def remember_saved_values(self):
+        self._saved_values = self.get_field_values()
+
+    def get_changed_fields(self):
+        """
+        Return the names of the fields that have changed since this
+        document was loaded from or saved to the database. For a document
+        that has never been saved, that's all of them.
+        """
+
+        if self.pk is None or not hasattr(self, '_saved_values'):
+            return set(f.attname for f in self._meta.fields)
+
+        values = self.get_field_values()
+        return set(name for name, value in values.iteritems()
+            if self._saved_values.get(name) != value)
+
+    def has_file_changed(self):
+        return ('file' in self.get_changed_fields() or
+            not getattr(self.file, '_committed', True))
+
+    def save(self, *args, **kwargs):
+        if not getattr(self.file, '_committed', True):
+            # Store a new file now, rather than in FileField.pre_save(), to
+            # get the digest that document_storage calculates as it goes.
+            self.file.save(self.file.name, self.file, save=False)
+
+        if self.has_file_changed():
+            digest = document_storage.get_digest(self.file.name)
+
+            if digest is not None:
+                self.file_digest = digest
+                self._digest_of = self.file.name
+            elif getattr(self, '_digest_of', None) != self.file.name:
+                # forget the digest of the old file
+                self.file_digest = ''
+
+        super(Document, self).save(*args, **kwargs)
+        self.remember_saved_values()
     
+    def set_extraction_status(self, status):
+        """
+        Record whether we could extract the text of the attached file,
+        saving it immediately if the document is already in the database,
+        without sending any signals (and therefore reindexing it again).
+        """
+
+        if self.extraction_status != status:
+            self.extraction_status = status
+            if self.pk is not None:
+                Document.objects.filter(pk=self.pk).update(
+                    extraction_status=status)
+                view_cache.bump_documents([self.pk])
+
     def get_authors(self):
         return ', '.join([u.full_name for u in self.authors.all()])
     get_authors.short_description = 'Authors'
@@ -74,3 +156,128 @@ class Document(models.Model):
         we use this to point to the read-only view page.
         """
         return ('admin:documents_document_readonly', [str(self.id)])
+
+def remember_loaded_values(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance.remember_saved_values()
+models.signals.post_init.connect(remember_loaded_values, sender=Document,
+    dispatch_uid="document_remember_loaded_values")
+
+def will_change(instance, field_names):
+    """
+    Return True if saving instance will create it, or change any of the
+    named fields in the database. Call it before saving, from pre_save.
+    """
+
+    if instance.pk is None:
+        return True
+
+    saved = list(instance.__class__._default_manager.filter(
+        pk=instance.pk).values(*field_names))
+
+    if not saved:
+        return True
+
+    return any(saved[0][name] != getattr(instance, name)
+        for name in field_names)
+
+class ExtractedText(models.Model):
+    """
+    Text extracted from a document file, cached by the SHA-256 digest of
+    the file's contents and the version of the extractor (Tika) used.
+    See extraction.py.
+    """
+
+    class Meta:
+        unique_together = (('digest', 'extractor_version'),)
+
+    digest = models.CharField(max_length=64)
+    extractor_version = models.CharField(max_length=255)
+    text = models.TextField(blank=True)
+    hits = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return "ExtractedText<%s>" % self.digest
+
+class IndexQueueEntry(models.Model):
+    """
+    A document waiting to be (re)indexed, or removed from the index, by
+    the process_index_queue command, when settings.DOCUMENTS_QUEUED_INDEXING
+    is enabled. See indexing.py.
+    """
+
+    class Meta:
+        ordering = ('created',)
+        verbose_name_plural = 'index queue entries'
+
+    UPDATE = 'update'
+    REMOVE = 'remove'
+    ACTION_CHOICES = (
+        (UPDATE, 'Update'),
+        (REMOVE, 'Remove'),
+    )
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (FAILED, 'Failed'),
+    )
+
+    # not a ForeignKey, so that we can still remove documents from the
+    # index after they have been deleted from the database
+    document_id = models.IntegerField(db_index=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES,
+        default=UPDATE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+        default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt = models.DateTimeField(default=datetime.datetime.now)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return "IndexQueueEntry<%s %s>" % (self.action, self.document_id)
+
+class OutgoingEmail(models.Model):
+    """
+    A notification email waiting to be sent by the send_queued_email
+    command, when settings.DOCUMENTS_QUEUED_EMAIL is enabled. See
+    notifications.py.
+    """
+
+    class Meta:
+        ordering = ('created',)
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (FAILED, 'Failed'),
+    )
+
+    recipient = models.EmailField()
+    from_email = models.CharField(max_length=255)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+        default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt = models.DateTimeField(default=datetime.datetime.now)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return "OutgoingEmail<%s: %s>" % (self.recipient, self.subject)
+
+# Connect the signal handlers that keep these caches up to date in every
+# process, not just those that happen to use them.
+import autocomplete
+import view_cache
@@ -0,0 +1,159 @@
+"""
+Notification emails to document uploaders, sent either immediately, or
+when settings.DOCUMENTS_QUEUED_EMAIL is True, through an outbox of
+OutgoingEmail rows that the send_queued_email command sends in batches
+over a single SMTP connection, so that the admin doesn't wait for the
+mail server.
+
+With settings.DOCUMENTS_EMAIL_DIGEST_INTERVAL set to a number of seconds,
+queued notifications for the same uploader are held until the oldest is
+that old, and then sent together as one digest email.
+
+Messages that can't be sent are retried with exponential backoff, and
+after too many attempts are left in the FAILED state, like queued
+indexing (see retries.py).
+"""
+
+import datetime
+import traceback
+
+from django.conf import settings
+from django.core import mail
+from django.db.models import Min
+
+from models import OutgoingEmail
+from retries import record_failure
+
+def is_enabled():
+    return getattr(settings, 'DOCUMENTS_QUEUED_EMAIL', False)
+
+def get_digest_interval():
+    return getattr(settings, 'DOCUMENTS_EMAIL_DIGEST_INTERVAL', None)
+
+def notify(template, context, recipient):
+    """
+    Render a mail_templated email and send it to recipient, or add it to
+    the outbox if queued email is enabled.
+    """
+
+    from mail_templated import EmailMessage
+    email = EmailMessage(template, context, to=[recipient])
+
+    if is_enabled():
+        OutgoingEmail.objects.create(recipient=recipient,
+            from_email=email.from_email, subject=email.subject,
+            body=email.body)
+    else:
+        email.send()
+
+def get_backlog_count():
+    return OutgoingEmail.objects.filter(status__in=(OutgoingEmail.PENDING,
+        OutgoingEmail.PROCESSING)).count()
+
+def claim_batch(batch_size):
+    """
+    Take up to batch_size pending messages that are due, marking them as
+    PROCESSING so that other senders running at the same time leave them
+    alone. In digest mode, only the messages of recipients whose oldest
+    pending message has waited for the digest interval are due, and all
+    of them are taken together.
+    """
+
+    now = datetime.datetime.now()
+    pending = OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING,
+        next_attempt__lte=now)
+    interval = get_digest_interval()
+
+    if interval:
+        cutoff = now - datetime.timedelta(seconds=interval)
+        # order_by() stops the default ordering from splitting the groups
+        recipients = pending.order_by().values('recipient').annotate(
+            oldest=Min('created')).filter(oldest__lte=cutoff). \
+            values_list('recipient', flat=True)[:batch_size]
+        pending = pending.filter(recipient__in=list(recipients))
+    else:
+        pending = pending[:batch_size]
+
+    claimed = [pk for pk in pending.values_list('pk', flat=True)
+        if OutgoingEmail.objects.filter(pk=pk,
+            status=OutgoingEmail.PENDING).update(
+            status=OutgoingEmail.PROCESSING)]
+
+    return list(OutgoingEmail.objects.filter(pk__in=claimed))
+
+def release_stale(seconds):
+    """
+    Return messages that have been PROCESSING for more than the given
+    number of seconds, presumably by a sender that crashed, to the outbox.
+    """
+
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+    return OutgoingEmail.objects.filter(status=OutgoingEmail.PROCESSING,
+        modified__lt=cutoff).update(status=OutgoingEmail.PENDING)
+
+def make_messages_without_digest(entries):
+    return [([entry], mail.EmailMessage(entry.subject, entry.body,
+        entry.from_email, [entry.recipient])) for entry in entries]
+
+def make_messages(entries):
+    """
+    Return a list of (entries, message) tuples: one message per entry,
+    or in digest mode, one per recipient.
+    """
+
+    if not get_digest_interval():
+        return make_messages_without_digest(entries)
+
+    by_recipient = {}
+    for entry in entries:
+        by_recipient.setdefault(entry.recipient, []).append(entry)
+
+    from mail_templated import EmailMessage
+    messages = []
+
+    for recipient, grouped in sorted(by_recipient.iteritems()):
+        if len(grouped) == 1:
+            messages.extend(make_messages_without_digest(grouped))
+        else:
+            digest = EmailMessage('email/notification_digest.txt.django',
+                {'entries': grouped, 'settings': settings}, to=[recipient])
+            messages.append((grouped, mail.EmailMessage(digest.subject,
+                digest.body, digest.from_email, [recipient])))
+
+    return messages
+
+def send_batch(entries, max_attempts=5, backoff=60):
+    """
+    Send a batch of claimed messages over a single connection to the mail
+    server. Returns the number of entries that failed.
+    """
+
+    failures = 0
+    connection = mail.get_connection()
+
+    try:
+        connection.open()
+    except Exception:
+        error = traceback.format_exc()
+        for entry in entries:
+            record_failure(entry, error, max_attempts, backoff)
+        return len(entries)
+
+    try:
+        for grouped, message in make_messages(entries):
+            message.connection = connection
+
+            try:
+                message.send()
+            except Exception:
+                error = traceback.format_exc()
+                for entry in grouped:
+                    record_failure(entry, error, max_attempts, backoff)
+                failures += len(grouped)
+            else:
+                OutgoingEmail.objects.filter(
+                    pk__in=[e.pk for e in grouped]).delete()
+    finally:
+        connection.close()
+
+    return failures
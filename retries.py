@@ -0,0 +1,35 @@
+"""
+Retrying queued work with exponential backoff, shared by the index queue
+(indexing.py) and the email outbox (notifications.py), whose entries
+have the same status and retry fields.
+"""
+
+import datetime
+
+def get_retry_delay(attempts, backoff):
+    """
+    Return how long to wait before the next attempt, after the given
+    number of failed attempts: backoff seconds, doubled for each failure
+    after the first.
+    """
+
+    return datetime.timedelta(seconds=backoff * (2 ** (attempts - 1)))
+
+def record_failure(entry, error, max_attempts, backoff):
+    """
+    Record a failed attempt to process a queued entry, such as an
+    IndexQueueEntry or an OutgoingEmail: it's retried later, unless it
+    has failed max_attempts times, when it's left in the FAILED state.
+    """
+
+    entry.attempts += 1
+    entry.last_error = error
+
+    if entry.attempts >= max_attempts:
+        entry.status = entry.FAILED
+    else:
+        entry.status = entry.PENDING
+        entry.next_attempt = datetime.datetime.now() + \
+            get_retry_delay(entry.attempts, backoff)
+
+    entry.save()
@@ -1,5 +1,4 @@
 import datetime
-import subprocess
 import os
 
 from django.db.models import signals
@@ -11,23 +10,87 @@ from haystack.fields import (CharField, MultiValueField, DateField,
     IntegerField, BooleanField)
 
 from models import Document
+import extraction
+import extractors
+import indexing
+import snippets
+import text_pipeline
+import view_cache
 
 class DocumentIndex(indexes.RealTimeSearchIndex, indexes.Indexable):
-    text = CharField(model_attr='file', document=True)
+    # The full text can be megabytes, so it's only indexed. Snippets are
+    # made from the bounded copy in summary instead, see snippets.py.
+    text = CharField(model_attr='file', document=True, stored=False)
     title = CharField(model_attr='title')
     notes = CharField(model_attr='notes')
     uploader = CharField(model_attr='uploader', null=True)
     authors = MultiValueField()
     author_names = MultiValueField()
     programs = MultiValueField()
-    document_type = IntegerField(model_attr='document_type__id')
+    document_type = IntegerField(model_attr='document_type_id')
     created = DateField(model_attr='created')
     deleted = BooleanField(model_attr='deleted')
+    confidential = BooleanField(model_attr='confidential')
     external_authors = CharField(model_attr='external_authors')
+
+    # Stored only to render search results without loading the documents,
+    # see search_queries.py.
+    document_type_name = CharField(model_attr='document_type__name',
+        null=True, indexed=False)
+    program_names = MultiValueField(indexed=False)
+    url = CharField(model_attr='get_absolute_url', indexed=False)
+    summary = CharField(indexed=False, null=True)
     
     def get_model(self):
         return Document
 
+    def index_queryset(self, using=None):
+        """
+        Load everything that the prepare_* methods need in a fixed number
+        of queries, however many documents are being indexed.
+        """
+        return self.get_model()._default_manager.select_related('uploader',
+            'document_type').prefetch_related('authors', 'programs')
+
+    def prepare(self, document):
+        """
+        Store the start of the text that was just prepared as the summary,
+        rather than extracting it again in prepare_summary().
+        """
+
+        data = super(DocumentIndex, self).prepare(document)
+        data['summary'] = snippets.get_summary(data.get('text'))
+        return data
+
+    def full_prepare(self, document):
+        try:
+            return super(DocumentIndex, self).full_prepare(document)
+        finally:
+            document.__dict__.pop('_index_authors', None)
+            document.__dict__.pop('_index_programs', None)
+
+    def get_authors(self, document):
+        """
+        Fetch the authors once for both of the author fields, unless they
+        were already prefetched by index_queryset().
+        """
+
+        if '_index_authors' not in document.__dict__:
+            document._index_authors = list(document.authors.all())
+        return document._index_authors
+
+    def get_programs(self, document):
+        """
+        Fetch the programs once for both of the program fields, unless
+        they were already prefetched by index_queryset(). Like the
+        authors, they are saved after the document, so DocumentAdmin
+        reindexes it again when they are.
+        """
+
+        if '_index_programs' not in document.__dict__:
+            document._index_programs = list(document.programs.all())
+        return document._index_programs
+
     def prepare_uploader(self, document):
         if document.uploader:
             return document.uploader.full_name
@@ -35,16 +98,19 @@ class DocumentIndex(indexes.RealTimeSearchIndex, indexes.Indexable):
             return None
     
     def prepare_authors(self, document):
-        return [u.id for u in document.authors.all()]
+        return [u.id for u in self.get_authors(document)]
     
     def prepare_author_names(self, document):
-        author_names = [u.full_name for u in document.authors.all()]
+        author_names = [u.full_name for u in self.get_authors(document)]
         if document.external_authors is not None and document.external_authors != '':
             author_names.append(document.external_authors)
         return author_names
         
     def prepare_programs(self, document):
-        return [p.id for p in document.programs.all()]
+        return [p.id for p in self.get_programs(document)]
+
+    def prepare_program_names(self, document):
+        return [p.name for p in self.get_programs(document)]
 
     def _setup_save(self):
         """Before allowing the model to be saved, we should check that
@@ -57,73 +123,58 @@ class DocumentIndex(indexes.RealTimeSearchIndex, indexes.Indexable):
         Document.on_validate.connect(self.test_object, sender=self.get_model(),
             dispatch_uid="document_index_on_validate_document")
 
+    def update_object(self, instance, using=None, **kwargs):
+        if indexing.is_enabled():
+            indexing.enqueue(instance.pk)
+        else:
+            super(DocumentIndex, self).update_object(instance, using,
+                **kwargs)
+
+    def remove_object(self, instance, using=None, **kwargs):
+        if indexing.is_enabled():
+            indexing.enqueue(instance.pk, indexing.IndexQueueEntry.REMOVE)
+        else:
+            super(DocumentIndex, self).remove_object(instance, using,
+                **kwargs)
+
     def test_object(self, instance, **kwargs):
         """
         Check that we can index a single object. Attached to the class's
         pre-save hook.
+
+        The extracted text is kept on the instance, so that indexing it
+        after it's saved doesn't have to extract it all over again.
         """
+        # Don't reuse text validated by an earlier clean(), the file may
+        # have changed since then.
+        instance.__dict__.pop('_validated_text', None)
+
+        # With queued indexing, text is only extracted by the queue worker,
+        # which records files that can't be extracted as failed entries.
+        if indexing.is_enabled():
+            return
+
         # Check to make sure we want to index this first.
         if self.should_update(instance, **kwargs):
             from django.core.exceptions import ValidationError
             try:
-                self.prepare_text(instance)
+                text = self.prepare_text(instance)
             except ValidationError as e:
                 raise ValidationError({'file': e})
+            instance._validated_text = text
 
     def safe_popen(self, cmd_with_args, *additional_args):
-        cmd_with_args.extend(additional_args)
-        
-        try:
-            return subprocess.Popen(cmd_with_args, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE)
-        except (OSError, IOError) as e:
-            raise Exception('%s: %s' % (cmd_with_args, e))
+        return extractors.safe_popen(cmd_with_args, *additional_args)
     
     def ensure_saved(self, file):
         """This may create a temporary file, which will be deleted when
         it's closed, so always close() it but only when you've finished!"""
-        
-        if isinstance(file, InMemoryUploadedFile):
-            print "Writing %s to disk (%d bytes)" % (file, file.size)
-            tmp = TemporaryUploadedFile(name=file.name,
-                content_type=file.content_type, size=file.size,
-                charset=file.charset)
-            file.seek(0)
-            buf = file.read()
-            tmp.write(buf)
-            print "Wrote %d bytes" % len(buf)
-            tmp.flush()
-        else:
-            tmp = file
-            
-        if isinstance(tmp, TemporaryUploadedFile):
-            path = tmp.temporary_file_path()
-        else:
-            path = tmp.name
-        
-        return (tmp, path)
+        return extractors.ensure_saved(file)
 
     def extract_text_using_tool(self, file, tool, format_name, original_name):
-        (tmp, path) = self.ensure_saved(file)
-
-        try:         
-            try:
-                process = self.safe_popen(tool, path)
-            except Exception as e:
-                raise Exception('Failed to convert %s document: %s' % 
-                    (format_name, e));
-                
-            (out, err) = process.communicate()
-            if err != '' and err != "Using ODF/OOXML parser.\n" \
-                and err != "Using XLS parser.\n":
-                # os.system("ls -la /tmp")
-                # err = err.replace(path, original_name)
-                raise Exception('Failed to convert %s document: %s' % 
-                    (format_name, err));
-        finally:
-            tmp.close()
-
-        return out
+        return extractors.extract_text_using_tool(file, tool, format_name,
+            original_name, ignored_errors=("Using ODF/OOXML parser.\n",
+                "Using XLS parser.\n"))
 
     def prepare_text(self, document):
         """
@@ -141,36 +192,90 @@ class DocumentIndex(indexes.RealTimeSearchIndex, indexes.Indexable):
             # nothing to index
             return
 
-        from django.conf import settings
-        from urlparse import urlparse
-        tika = urlparse(settings.TIKA_SERVER)
+        # Use the text extracted by test_object() when this document was
+        # validated, but only once: any later change must be re-extracted.
+        validated_text = document.__dict__.pop('_validated_text', None)
+        if validated_text is not None:
+            return validated_text
 
-        from httplib import HTTPConnection, HTTPSConnection
-        if tika.scheme == 'http':
-            conn = HTTPConnection(tika.netloc, None, True, 30)
-        elif tika.scheme == 'https':
-            conn = HTTPSConnection(tika.netloc, None, True, 30)
-        else:
-            raise Exception("Unknown URL scheme '%s' in Apache Tika URL: %s" %
-                (tika.scheme, settings.TIKA_SERVER))
+        # If we couldn't extract the same file before, don't try again
+        # every time its metadata changes, unless asked to (see the
+        # reindex_documents command).
+        if (document.extraction_status == Document.EXTRACTION_DEGRADED and
+            not document.has_file_changed() and
+            not getattr(document, '_retry_extraction', False)):
+            return self.get_metadata_text(document)
+
+        # If only the metadata has changed, reuse the text that we
+        # extracted from the same file before, without even reading it.
+        if document.file_digest and not document.has_file_changed():
+            text = extraction.get_cached_text_for(document.file_digest,
+                extractors.choose(document.file.name))
+            if text is not None:
+                return text_pipeline.process(text)
+
+        try:
+            text = self.extract_document_text(document)
+        except extractors.ExtractionLimitExceeded:
+            # Index what we can, rather than refusing to save the document
+            # or holding up the queue forever.
+            document.set_extraction_status(Document.EXTRACTION_DEGRADED)
+            return self.get_metadata_text(document)
+
+        document.set_extraction_status(Document.EXTRACTION_OK)
+        return text_pipeline.process(text)
 
-        real_file_object = document.file.file
+    def get_metadata_text(self, document):
+        """
+        The text indexed for a document whose file we couldn't extract.
+        """
 
-        if isinstance(real_file_object, InMemoryUploadedFile):
-            buffer = document.file.read()
+        return u'%s\n%s' % (document.title, document.notes)
+
+    def extract_document_text(self, document):
+        if getattr(document.file, '_committed', True):
+            # Open the stored file by path: document.file.file would open
+            # another handle that FieldFile keeps until it's closed.
+            path = document.file.path
         else:
+            # a new upload, already open
+            real_file_object = document.file.file
+
+            if isinstance(real_file_object, InMemoryUploadedFile):
+                return self.extract_file_text(document, real_file_object)
+
             if isinstance(real_file_object, TemporaryUploadedFile):
                 path = real_file_object.temporary_file_path()
             else:
                 path = real_file_object.name
-            buffer = open(path, 'rb')
-        
-        conn.request('PUT', '%s/tika' % tika.path, buffer)
-        response = conn.getresponse()
 
-        if response.status != 200:
-            raise Exception("Unknown response from TIKA server " +
-                "(%s): %s: %s" % (settings.TIKA_SERVER, response.status,
-                    response.reason))
+        source = open(path, 'rb')
+        try:
+            return self.extract_file_text(document, source)
+        finally:
+            source.close()
+
+    def extract_file_text(self, document, source):
+        """
+        Extract the text of the document's file, open as source, and
+        remember its digest on the document.
+        """
+
+        if document.file_digest and (not document.has_file_changed() or
+            getattr(document, '_digest_of', None) == document.file.name):
+            # saved with the same file, or already calculated by
+            # DocumentForm or document_storage
+            digest = document.file_digest
+        else:
+            digest = extraction.file_digest(source)
+            document.file_digest = digest
+            document._digest_of = document.file.name
+
+            if document.pk is not None and not document.has_file_changed():
+                # fill in the digest of files saved before we kept them
+                Document.objects.filter(pk=document.pk).update(
+                    file_digest=digest)
+                view_cache.bump_documents([document.pk])
 
-        return response.read()
+        return extraction.get_or_extract_text(source, document.file.name,
+            extractors.choose(document.file.name), digest)
@@ -0,0 +1,57 @@
+"""
+Searching for documents in the index, and rendering the results from the
+fields stored in the index, without loading them from the database.
+"""
+
+from django.template.loader import render_to_string
+
+from haystack.query import SearchQuerySet, SQ
+
+from models import Document
+import snippets
+import visibility
+
+class DocumentSearchQuerySet(SearchQuerySet):
+    """
+    A SearchQuerySet that only ever finds documents that haven't been
+    deleted, and with visible_to(), only those that a user may see. All
+    the filtering is done by the search backend, so counts and pages of
+    results are exact, and only the current page is fetched.
+    """
+
+    def __init__(self, using=None, query=None):
+        new = query is None
+        super(DocumentSearchQuerySet, self).__init__(using=using, query=query)
+
+        # Clones are given the query of the original, which already has
+        # these filters.
+        if new:
+            self.query.add_model(Document)
+            self.query.add_filter(SQ(deleted=False))
+
+    def visible_to(self, request):
+        """
+        Limit the results to documents that the user who made the request
+        may find, with the same program rule as DocumentAdmin, and without
+        confidential documents for guests (see visibility.py).
+        """
+
+        return self.filter(**visibility.get_filters(request))
+
+def render_results(results, query=None,
+    template='documents/search_results.html'):
+    """
+    Render a page of search results (SearchResult objects) as a table,
+    using only their stored fields, so it takes no database queries
+    however many results there are. Don't use result.object in the
+    template, that loads the document.
+
+    Each result is given a snippet of its text around the words of the
+    query, see snippets.py.
+    """
+
+    for result in results:
+        result.snippet = snippets.get_snippet(getattr(result, 'summary',
+            None), query)
+
+    return render_to_string(template, {'results': results, 'query': query})
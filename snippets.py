@@ -0,0 +1,102 @@
+"""
+Excerpts of document text for search results, with the search terms
+highlighted.
+
+The full text of a document can be megabytes, so the index only stores
+its first settings.DOCUMENTS_SUMMARY_SIZE characters (20,000 by default)
+as the summary field, and snippets are made from that. Making a snippet
+looks at no more than settings.DOCUMENTS_SNIPPET_MAX_SCAN characters of
+the summary, so the cost of a results page doesn't depend on the size of
+the documents. Terms that only appear after that point are not found,
+and the snippet is taken from the start of the text instead.
+"""
+
+import re
+
+from django.conf import settings
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+def get_summary_size():
+    return getattr(settings, 'DOCUMENTS_SUMMARY_SIZE', 20000)
+
+def get_summary(text):
+    """
+    Return the part of a document's text to store in the index for
+    making snippets.
+    """
+
+    if text is None:
+        return None
+
+    size = get_summary_size()
+    if len(text) <= size:
+        return text
+
+    # don't cut a word in half
+    summary = text[:size]
+    space = summary.rfind(' ', size - 100)
+    if space > 0:
+        summary = summary[:space]
+    return summary
+
+def get_terms(query):
+    return [term for term in re.split(r'\W+', query or '', flags=re.UNICODE)
+        if term]
+
+def highlight(text, pattern):
+    """
+    Escape text as HTML, wrapping whatever matches pattern in <em> tags.
+    """
+
+    if pattern is None:
+        return escape(text)
+
+    parts = []
+    end = 0
+
+    for match in pattern.finditer(text):
+        parts.append(escape(text[end:match.start()]))
+        parts.append(u'<em>%s</em>' % escape(match.group(0)))
+        end = match.end()
+
+    parts.append(escape(text[end:]))
+    return u''.join(parts)
+
+def get_snippet(text, query, length=None, max_scan=None):
+    """
+    Return about length characters of text around the first of the words
+    in the query that appears in it, as HTML with the words highlighted.
+    """
+
+    if length is None:
+        length = getattr(settings, 'DOCUMENTS_SNIPPET_LENGTH', 200)
+    if max_scan is None:
+        max_scan = getattr(settings, 'DOCUMENTS_SNIPPET_MAX_SCAN', 20000)
+
+    if not text:
+        return u''
+
+    scanned = text[:max_scan]
+    terms = get_terms(query)
+    start = 0
+
+    if terms:
+        pattern = re.compile(u'|'.join(re.escape(t) for t in terms),
+            re.IGNORECASE | re.UNICODE)
+        match = pattern.search(scanned)
+        if match:
+            # show a little of the text before the first match
+            start = max(0, match.start() - length / 4)
+    else:
+        pattern = None
+
+    excerpt = scanned[start:start + length]
+    html = highlight(excerpt, pattern)
+
+    if start > 0:
+        html = u'&hellip;' + html
+    if start + len(excerpt) < len(text):
+        html = html + u'&hellip;'
+
+    return mark_safe(html)
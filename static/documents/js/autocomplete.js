@@ -0,0 +1,53 @@
+/*
+ * Turns select.autocomplete elements (see widgets.py) into a search box
+ * that adds options from the JSON view in data-autocomplete-url as the
+ * user types, a page at a time, instead of listing every choice.
+ */
+(function($) {
+	$(function() {
+		$('select.autocomplete').each(function() {
+			var select = $(this);
+			var url = select.attr('data-autocomplete-url');
+			var input = $('<input type="text" class="autocomplete-search" />');
+			var list = $('<ul class="autocomplete-results"></ul>');
+			var timer = null;
+			var page = 1;
+
+			select.before(input).after(list);
+
+			function search(more) {
+				page = more ? page + 1 : 1;
+
+				$.getJSON(url, {q: input.val(), page: page}, function(data) {
+					if (!more) {
+						list.empty();
+					}
+
+					list.find('.autocomplete-more').remove();
+
+					$.each(data.results, function(i, result) {
+						$('<li></li>').text(result.text).click(function() {
+							if (!select.find('option[value="' + result.id + '"]').length) {
+								$('<option></option>').val(result.id)
+									.text(result.text).appendTo(select);
+							}
+							select.find('option[value="' + result.id + '"]')
+								.attr('selected', 'selected');
+						}).appendTo(list);
+					});
+
+					if (data.more) {
+						$('<li class="autocomplete-more">More&hellip;</li>')
+							.click(function() { search(true); })
+							.appendTo(list);
+					}
+				});
+			}
+
+			input.keyup(function() {
+				clearTimeout(timer);
+				timer = setTimeout(function() { search(false); }, 250);
+			});
+		});
+	});
+})(django.jQuery);
@@ -0,0 +1,113 @@
+"""
+Storage for document files.
+
+Files are stored once by the SHA-256 digest of their contents, which is
+calculated while they are written, as <upload_to>/<aa>/<digest><.ext>
+where aa is the first two digits of the digest, so that documents with
+the same file share one copy on disk (and its extracted text, see
+extraction.py). Files that no document refers to any more are deleted
+later by the delete_unused_files command, not when the document changes,
+which might yet be rolled back, or race with another upload of the same
+file.
+
+Files are linked through the download view (see downloads.py), which
+checks that the user may see a document before serving its file, instead
+of directly under MEDIA_URL. The web server should not serve
+MEDIA_ROOT/documents itself.
+"""
+
+import errno
+import hashlib
+import os
+import os.path
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.urlresolvers import reverse
+
+DIGEST_RE = re.compile(r'^([0-9a-f]{64})(\.[^.]*)?$')
+
+class DocumentStorage(FileSystemStorage):
+    def url(self, name):
+        from urls import NAME_PREFIX
+        return reverse(NAME_PREFIX + 'download', kwargs={'name': name})
+
+    def get_available_name(self, name):
+        # The name is replaced by one made from the digest in _save(), and
+        # files with the same name have the same contents.
+        return name
+
+    def get_digest(self, name):
+        """
+        Return the digest of the contents of a file stored by this
+        storage, from its name, or None for files stored before.
+        """
+
+        match = DIGEST_RE.match(os.path.basename(name or ''))
+        return match.group(1) if match else None
+
+    def touch(self, full_path):
+        """
+        Mark an existing copy of a file as just stored, so that
+        delete_unused_files leaves it alone until the document that
+        uses it is saved. Returns False if there is no copy.
+        """
+
+        try:
+            os.utime(full_path, None)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+        return True
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        full_directory = self.path(directory)
+
+        if not os.path.isdir(full_directory):
+            os.makedirs(full_directory)
+
+        # Write to a temporary file in the same file system, hashing the
+        # contents as they go, and then move it into place if we don't
+        # have a copy already.
+        (fd, temp_path) = tempfile.mkstemp(dir=full_directory)
+        digest = hashlib.sha256()
+
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+
+            digest = digest.hexdigest()
+            extension = os.path.splitext(name)[1].lower()
+            name = os.path.join(directory, digest[:2], digest + extension)
+            full_path = self.path(name)
+
+            if self.touch(full_path):
+                os.remove(temp_path)
+            else:
+                try:
+                    os.makedirs(os.path.dirname(full_path))
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+
+                os.rename(temp_path, full_path)
+
+                if settings.FILE_UPLOAD_PERMISSIONS is not None:
+                    os.chmod(full_path, settings.FILE_UPLOAD_PERMISSIONS)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return name
+
+document_storage = DocumentStorage()
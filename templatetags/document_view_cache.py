@@ -0,0 +1,50 @@
+from django import template
+
+from documents import view_cache
+
+register = template.Library()
+
+class DocumentViewCacheNode(template.Node):
+    def __init__(self, nodelist, key):
+        self.nodelist = nodelist
+        self.key = template.Variable(key)
+
+    def render(self, context):
+        try:
+            key = self.key.resolve(context)
+        except template.VariableDoesNotExist:
+            key = None
+
+        if not key:
+            # not cacheable, e.g. the change form rather than the view
+            return self.nodelist.render(context)
+
+        value = view_cache.get_fragment(key)
+
+        if value is None:
+            value = self.nodelist.render(context)
+            view_cache.set_fragment(key, value)
+
+        return value
+
+@register.tag
+def document_view_cache(parser, token):
+    """
+    Cache the enclosed part of the read-only document page under the
+    key given by the admin (see view_cache.get_key()):
+
+    {% document_view_cache document_view_cache_key %}
+        ...
+    {% enddocument_view_cache %}
+
+    The contents are rendered as usual if the key is empty.
+    """
+
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError("%r tag requires one argument" %
+            bits[0])
+
+    nodelist = parser.parse(('enddocument_view_cache',))
+    parser.delete_first_token()
+    return DocumentViewCacheNode(nodelist, bits[1])
@@ -66,6 +66,9 @@ class DocumentsModuleTest(AptivateEnhancedTestCase, DocumentTestMixin):
         # fails with PermissionDenied if our permissions are wrong
 
         self.index = self.unified_index.get_index(Document) 
+
+        from documents import extractors
+        extractors.reset_latency()
     
     def login(self, user=None):
         if user is None:
@@ -109,7 +112,9 @@ class DocumentsModuleTest(AptivateEnhancedTestCase, DocumentTestMixin):
         self.assertEqual(DocumentType.objects.all()[0], doc.document_type)
         self.assertItemsEqual([Program.objects.all()[0]], doc.programs.all())
         import re
-        self.assertRegexpMatches(doc.file.name, 'boink(_\d+)?.png',
+        # files are stored by the SHA-256 digest of their contents
+        self.assertRegexpMatches(doc.file.name,
+            r'^documents/[0-9a-f]{2}/[0-9a-f]{64}\.png$',
             "Wrong name on uploaded file")
         self.assertEqual('whee', doc.notes)
         self.assertItemsEqual([], doc.authors.all())
@@ -168,6 +173,29 @@ class DocumentsModuleTest(AptivateEnhancedTestCase, DocumentTestMixin):
             "&\"Times New Roman,Regular\"&12Page &P\t\n\n\n",
             self.index.prepare_text(doc))
 
+    def test_text_pipeline_compacts_excel_2007_text(self):
+        from documents import text_pipeline
+
+        doc = Document()
+        self.assign_fixture_to_filefield('excel_2007.xlsx', doc.file)
+        text_pipeline.stats.clear()
+
+        with self.settings(DOCUMENTS_TEXT_PIPELINE=('remove_boilerplate',
+            'remove_duplicate_lines', 'collapse_whitespace', 'truncate')):
+            self.assertEquals("Sheet1\nLorem ipsum dolor sit amet, " +
+                "consectetur adipiscing elit. Praesent pharetra urna eu " +
+                "arcu blandit nec pretium odio fermentum.\nSed in orci " +
+                "quis risus interdum lacinia ut eu nisl.\nSed facilisis " +
+                "nibh eu diam tincidunt pellentesque semper nulla auctor." +
+                "\n\nSheet2\n\nSheet3", self.index.prepare_text(doc))
+
+        self.assertEqual(1, text_pipeline.stats['documents'])
+        self.assertEqual(201, text_pipeline.stats['remove_boilerplate'])
+        self.assertEqual(26, text_pipeline.stats['collapse_whitespace'])
+
+        with self.settings(DOCUMENTS_TEXT_MAX_CHARS=6):
+            self.assertEquals("Sheet1", self.index.prepare_text(doc))
+
     def test_powerpoint_2003_indexing(self):
         doc = Document()
         self.assign_fixture_to_filefield('powerpoint_2003.ppt', doc.file) 
@@ -199,6 +227,336 @@ class DocumentsModuleTest(AptivateEnhancedTestCase, DocumentTestMixin):
             "nec pretium odio fermentum. Sed in orci quis risus interdum " +
             "lacinia ut eu nisl.\n\n\n", self.index.prepare_text(doc))
 
+    def test_extracted_text_is_cached_by_file_contents(self):
+        from documents import extraction
+        from documents.models import ExtractedText
+
+        doc = Document()
+        self.assign_fixture_to_filefield('word_2007.docx', doc.file)
+        text = self.index.prepare_text(doc)
+        self.assertEqual(1, ExtractedText.objects.count())
+
+        # a different document with the same contents should not need
+        # to be sent to Tika again
+        hits = extraction.stats['hits']
+        other = Document()
+        self.assign_fixture_to_filefield('word_2007.docx', other.file)
+        self.assertEqual(text, self.index.prepare_text(other))
+        self.assertEqual(hits + 1, extraction.stats['hits'])
+        self.assertEqual(1, ExtractedText.objects.get().hits)
+
+    def test_upload_extracts_text_only_once(self):
+        from documents import extraction
+        stats = dict(extraction.stats)
+
+        self.assert_create_document_by_post()
+
+        # extracted once during validation, and reused (without even
+        # looking in the cache) when the saved document was indexed
+        self.assertEqual(stats['misses'] + 1, extraction.stats['misses'])
+        self.assertEqual(stats['hits'], extraction.stats['hits'])
+
+    def test_tika_connections_are_kept_alive_and_reused(self):
+        from documents import tika_client
+        pool = tika_client.TikaPool(tika_client.get_server_urls()[:1])
+        endpoint = pool.endpoints[0]
+
+        version = pool.request('GET', '/version')
+        self.assertEqual(1, endpoint.idle.qsize())
+        conn = endpoint.idle.queue[0]
+
+        self.assertEqual(version, pool.request('GET', '/version'))
+        self.assertEqual(1, endpoint.idle.qsize())
+        self.assertIs(conn, endpoint.idle.queue[0])
+
+    def test_extracted_text_is_limited_to_max_size(self):
+        import os
+        path = os.path.join(os.path.dirname(__file__), 'fixtures',
+            'word_2007.docx')
+
+        from documents import extractors
+        with open(path, 'rb') as f:
+            with self.settings(TIKA_MAX_TEXT_SIZE=11):
+                self.assertEqual("Lorem ipsum",
+                    extractors.tika.extract(f, 'word_2007.docx'))
+
+    def test_queued_indexing_defers_indexing_to_worker(self):
+        from documents import indexing
+        from documents.models import IndexQueueEntry
+        from search.queries import SearchQuerySetWithAllFields
+        sqs = SearchQuerySetWithAllFields().models(Document)
+
+        with self.settings(DOCUMENTS_QUEUED_INDEXING=True):
+            self.assert_create_document_by_post(title="Queued")
+            doc = Document.objects.get()
+
+            entry = IndexQueueEntry.objects.get()
+            self.assertEqual(doc.id, entry.document_id)
+            self.assertEqual(IndexQueueEntry.UPDATE, entry.action)
+            self.assertEqual(1, indexing.get_backlog_count())
+            self.assertSequenceEqual([], list(sqs.filter(title="Queued")))
+
+            response = self.client.get(
+                reverse('admin:documents_document_changelist'))
+            self.assertEqual(1, response.context['index_backlog'])
+
+            # saving again should not queue it twice
+            doc.save()
+            self.assertEqual(1, IndexQueueEntry.objects.count())
+
+            entries = indexing.claim_batch(10)
+            self.assertEqual(0, indexing.process_batch(entries))
+
+        self.assertEqual(0, IndexQueueEntry.objects.count())
+        self.assertEqual(1, len(sqs.filter(title="Queued")))
+
+    def test_queued_indexing_gives_up_after_max_attempts(self):
+        from documents import indexing
+        from documents.models import IndexQueueEntry
+
+        with self.settings(DOCUMENTS_QUEUED_INDEXING=True):
+            self.assert_create_document_by_post()
+
+        def broken_prepare_text(document):
+            raise Exception("Tika is down")
+        self.index.prepare_text = broken_prepare_text
+
+        try:
+            entries = indexing.claim_batch(10)
+            self.assertEqual(1, indexing.process_batch(entries,
+                max_attempts=2, backoff=0))
+            entry = IndexQueueEntry.objects.get()
+            self.assertEqual(IndexQueueEntry.PENDING, entry.status)
+
+            entries = indexing.claim_batch(10)
+            self.assertEqual(1, indexing.process_batch(entries,
+                max_attempts=2, backoff=0))
+            entry = IndexQueueEntry.objects.get()
+            self.assertEqual(IndexQueueEntry.FAILED, entry.status)
+            self.assertIn("Tika is down", entry.last_error)
+            self.assertEqual([], indexing.claim_batch(10))
+        finally:
+            del self.index.prepare_text
+
+    def test_reindex_documents_command_indexes_missing_documents(self):
+        from django.core.management import call_command
+        from search.queries import SearchQuerySetWithAllFields
+        sqs = SearchQuerySetWithAllFields().models(Document)
+
+        # create a document without indexing it
+        with self.settings(DOCUMENTS_QUEUED_INDEXING=True):
+            self.assert_create_document_by_post(title="Unindexed")
+        self.assertSequenceEqual([], list(sqs.filter(title="Unindexed")))
+
+        call_command('reindex_documents', workers=1, only_missing=True,
+            verbosity=0)
+        self.assertEqual(1, len(sqs.filter(title="Unindexed")))
+
+        # failed documents aren't recorded as done, so they are retried
+        from documents.management.commands.reindex_documents import \
+            get_done_ranges
+        self.assertEqual([(1, 2), (5, 8)],
+            get_done_ranges([1, 2, 3, 5, 8], {3: "Tika is down"}))
+
+    def test_indexing_documents_takes_constant_queries(self):
+        for i in range(3):
+            doc = Document(title="doc %d" % i, notes="bonk",
+                document_type=DocumentType.objects.all()[0],
+                hyperlink="http://foo.example.com/%d" % i,
+                uploader=self.john)
+            doc.save()
+            doc.authors = [self.john, self.ringo]
+            doc.programs = Program.objects.all()[:2]
+
+        # one query for the documents, uploaders and document types,
+        # and one each for the prefetched authors and programs
+        with self.assertNumQueries(3):
+            documents = list(self.index.index_queryset())
+        self.assertEqual(3, len(documents))
+
+        with self.assertNumQueries(0):
+            for doc in documents:
+                prepared = self.index.full_prepare(doc)
+
+        self.assertItemsEqual([self.john.id, self.ringo.id],
+            prepared['authors'])
+        self.assertItemsEqual([self.john.full_name, self.ringo.full_name],
+            prepared['author_names'])
+        self.assertEqual(self.john.full_name, prepared['uploader'])
+
+    def count_queries(self, function, *args, **kwargs):
+        from django.db import connection
+        old_use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+
+        try:
+            function(*args, **kwargs)
+        finally:
+            connection.use_debug_cursor = old_use_debug_cursor
+
+        return len(connection.queries) - start
+
+    def test_admin_changelist_queries_do_not_grow_with_rows(self):
+        def add_documents(count):
+            for i in range(count):
+                doc = Document(title="doc %d" % Document.objects.count(),
+                    notes="bonk", document_type=DocumentType.objects.all()[0],
+                    hyperlink="http://foo.example.com/", uploader=self.john)
+                doc.save()
+                doc.authors = [self.john, self.ringo]
+
+        url = reverse('admin:documents_document_changelist')
+
+        add_documents(2)
+        small_page = self.count_queries(self.client.get, url)
+
+        add_documents(8)
+        response = self.client.get(url)
+        self.assertEqual(10, len(response.context['cl'].result_list))
+        large_page = self.count_queries(self.client.get, url)
+
+        self.assertEqual(small_page, large_page)
+
+    def test_local_extractor_is_used_when_tika_fails(self):
+        from documents import extractors
+
+        def tika_is_down(*args):
+            raise Exception("Tika is down")
+        extractors.tika.get_version = tika_is_down
+
+        try:
+            doc = Document()
+            doc.file.save(name="notes.txt",
+                content=ContentFile("plain old text"), save=False)
+            self.assertEqual("plain old text", self.index.prepare_text(doc))
+
+            doc = Document()
+            self.assign_fixture_to_filefield('word_2007.docx', doc.file)
+            with self.assertRaisesRegexp(Exception, "Tika is down"):
+                self.index.prepare_text(doc)
+        finally:
+            del extractors.tika.get_version
+
+    def test_extraction_limit_exceeded_wins_over_other_failures(self):
+        from documents import extraction, extractors
+
+        class Broken(extractors.Extractor):
+            name = 'broken'
+            def extract(self, file, original_name):
+                raise Exception("broken")
+
+        class Slow(extractors.Extractor):
+            name = 'slow'
+            def extract(self, file, original_name):
+                raise extractors.ExtractionLimitExceeded("too slow")
+
+        with self.assertRaises(extractors.ExtractionLimitExceeded):
+            extraction.get_or_extract_text(ContentFile("text"), 'notes.txt',
+                [Broken(), Slow()])
+
+    def test_plain_text_is_truncated_between_characters(self):
+        from documents import extractors
+
+        text = u'caf\xe9'.encode('utf-8')
+        with self.settings(DOCUMENTS_EXTRACTOR_LIMITS={'plain':
+            {'output': len(text) - 1}}):
+            self.assertEqual('caf', extractors.PlainTextExtractor().extract(
+                ContentFile(text), 'notes.txt'))
+
+    def test_tika_version_failure_is_remembered_briefly(self):
+        from documents import extraction, extractors, tika_client
+
+        calls = []
+        def tika_is_down(*args, **kwargs):
+            calls.append(kwargs.get('retries'))
+            raise Exception("Tika is down")
+
+        original_request = tika_client.request
+        tika_client.request = tika_is_down
+        tika_client.reset_version()
+
+        try:
+            digest = 'a' * 64
+            extraction.store_text(digest, 'tika-0.9', 'old text')
+
+            for i in range(2):
+                # lookups fall back to the text from the newest version
+                self.assertEqual('old text',
+                    extraction.get_cached_text_for(digest, [extractors.tika]))
+
+            # asked once, without retries
+            self.assertEqual([0], calls)
+        finally:
+            tika_client.request = original_request
+            tika_client.reset_version()
+
+    def test_fastest_extraction_strategy_skips_tika_for_plain_text(self):
+        from documents import extractors
+        self.assertEqual(extractors.tika, extractors.choose('notes.txt')[0])
+
+        with self.settings(DOCUMENTS_EXTRACTION_STRATEGY='fastest'):
+            local = extractors.choose('notes.txt')[0]
+            self.assertIsInstance(local, extractors.PlainTextExtractor)
+            self.assertEqual([extractors.tika],
+                extractors.choose('slides.pptx'))
+
+    def test_extraction_over_time_limit_indexes_title_and_notes_only(self):
+        from documents import extractors
+
+        attempts = []
+        def too_slow(file, original_name):
+            attempts.append(original_name)
+            raise extractors.ExtractionLimitExceeded("timed out")
+        extractors.tika.extract = too_slow
+
+        try:
+            self.assert_create_document_by_post(title="Slow", notes="whee")
+            doc = Document.objects.get()
+            self.assertEqual(Document.EXTRACTION_DEGRADED,
+                doc.extraction_status)
+
+            # not tried again when only the metadata changes
+            del attempts[:]
+            self.assertEqual(u"Slow\nwhee", self.index.prepare_text(doc))
+            self.assertEqual([], attempts)
+        finally:
+            del extractors.tika.extract
+
+        # once extraction works again, reindex_documents can retry it
+        from django.core.management import call_command
+        call_command('reindex_documents', workers=1, retry_degraded=True,
+            verbosity=0)
+        self.assertEqual(Document.EXTRACTION_OK,
+            Document.objects.get().extraction_status)
+
+    def test_metadata_changes_reuse_extracted_text(self):
+        from documents import extractors
+
+        self.assert_create_document_by_post(title="Before")
+        doc = Document.objects.get()
+        self.assertTrue(doc.file_digest)
+        self.assertEqual(set(), doc.get_changed_fields())
+
+        def must_not_extract(file, original_name):
+            raise AssertionError("should not extract the file again")
+        extractors.tika.extract = must_not_extract
+
+        try:
+            doc.title = "After"
+            doc.deleted = True
+            self.assertEqual(set(['title', 'deleted']),
+                doc.get_changed_fields())
+            self.assertFalse(doc.has_file_changed())
+            doc.save()
+            self.assertEqual(set(), doc.get_changed_fields())
+        finally:
+            del extractors.tika.extract
+
+        from search.queries import SearchQuerySetWithAllFields
+        results = SearchQuerySetWithAllFields().models(Document)
+        self.assertEqual(["After"], [r.title for r in results])
+
     def test_document_page_changelist(self):
         doc = Document(title='foo bar', document_type=DocumentType.objects.all()[0],
             notes="bonk")
@@ -296,6 +654,66 @@ class DocumentsModuleTest(AptivateEnhancedTestCase, DocumentTestMixin):
         doc = Document.objects.get(id=doc.id)
         self.assertTrue(doc.deleted, "Document should have been deleted")
 
+    def test_delete_confirmation_queries_do_not_grow_with_relations(self):
+        def delete_page_queries(authors):
+            doc = Document(title="doc %d" % Document.objects.count(),
+                notes="bonk", document_type=DocumentType.objects.all()[0],
+                hyperlink="http://foo.example.com/", uploader=self.john)
+            doc.save()
+            doc.authors = authors
+            doc.programs = Program.objects.all()
+
+            url = reverse('admin:documents_document_delete', args=[doc.id])
+            self.client.get(url) # warm up any caches
+            return self.count_queries(self.client.get, url)
+
+        self.assertEqual(delete_page_queries([self.john]),
+            delete_page_queries(IntranetUser.objects.all()))
+
+    def test_author_autocomplete_searches_by_prefix(self):
+        from django.utils import simplejson
+        from documents import autocomplete
+        from documents.urls import NAME_PREFIX
+
+        url = reverse(NAME_PREFIX + 'autocomplete',
+            kwargs={'source': 'authors'})
+        prefix = self.ringo.full_name[:3]
+
+        response = self.client.get(url, {'q': prefix.lower()})
+        self.assertEqual(200, response.status_code)
+        data = simplejson.loads(response.content)
+        self.assertIn({'id': self.ringo.id, 'text': self.ringo.full_name},
+            data['results'])
+        for result in data['results']:
+            self.assertTrue(result['text'].lower().startswith(prefix.lower()))
+        self.assertFalse(data['more'])
+
+        # the same page again comes from the cache
+        with self.assertNumQueries(0):
+            autocomplete.sources['authors'].search(prefix.lower())
+
+        # even after a user logs in, which saves them
+        self.ken.save()
+        with self.assertNumQueries(0):
+            autocomplete.sources['authors'].search(prefix.lower())
+
+        # until a user's name changes
+        self.ringo.full_name = 'Zebedee'
+        self.ringo.save()
+        (results, more) = autocomplete.sources['authors'].search(prefix)
+        self.assertNotIn(self.ringo.id, [pk for pk, label in results])
+
+    def test_document_form_only_renders_selected_authors(self):
+        doc = Document(title="foo", document_type=DocumentType.objects.all()[0],
+            notes="bonk", uploader=self.john)
+        doc.save()
+        doc.authors = [self.ringo]
+
+        response = self.client.get(reverse('admin:documents_document_change',
+            args=[doc.id]))
+        self.assertContains(response, self.ringo.full_name)
+        self.assertNotContains(response, '<option value="%d"' % self.ken.id)
+
     def test_uploader_can_delete_file(self):
         self.assert_create_document_by_post(title='whee')
         self.assert_delete_document(Document.objects.get(title="whee"))
@@ -474,6 +892,156 @@ class DocumentsModuleTest(AptivateEnhancedTestCase, DocumentTestMixin):
             args=[doc.id]))
         self.extract_admin_form(response) # check that there is one
         
+    def test_visibility_scope_is_cached_until_groups_change(self):
+        from django.contrib.auth.models import Group
+        from django.http import HttpRequest
+        from documents import visibility
+
+        guest = Group.objects.get(name="Guest")
+        self.assertNotIn(guest, self.ken.groups.all())
+
+        def get_scope():
+            request = HttpRequest()
+            request.user = self.ken
+            scope = visibility.get_scope(request)
+            # the second call on the same request doesn't even hit the cache
+            with self.assertNumQueries(0):
+                self.assertEqual(scope, visibility.get_scope(request))
+            return scope
+
+        self.assertEqual((False, None), get_scope())
+        with self.assertNumQueries(0):
+            get_scope()
+
+        self.ken.groups.add(guest)
+        self.assertEqual((True, self.ken.program_id), get_scope())
+
+        guest.user_set.remove(self.ken)
+        self.assertEqual((False, None), get_scope())
+
+    def test_document_search_queryset_filters_in_backend(self):
+        from django.contrib.auth.models import Group
+        from django.http import HttpRequest
+        from documents.search_queries import DocumentSearchQuerySet
+
+        programs = Program.objects.all()
+        self.assert_create_document_by_post(title='visible',
+            programs=programs[0].id)
+        self.assert_create_document_by_post(title='other',
+            programs=programs[1].id)
+        self.assert_create_document_by_post(title='secret',
+            programs=programs[0].id, confidential=True)
+        self.assert_create_document_by_post(title='gone',
+            programs=programs[0].id)
+        doc = Document.objects.get(title='gone')
+        doc.deleted = True
+        doc.save()
+
+        def titles(sqs):
+            return sorted(r.title for r in sqs)
+
+        sqs = DocumentSearchQuerySet()
+        self.assertEqual(['other', 'secret', 'visible'], titles(sqs))
+        self.assertEqual(3, sqs.count())
+
+        self.ken.program = programs[0]
+        self.ken.save()
+        self.ken.groups.add(Group.objects.get(name="Guest"))
+        request = HttpRequest()
+        request.user = self.ken
+
+        with self.assertNumQueries(1): # only the scope lookup
+            results = sqs.visible_to(request)
+            self.assertEqual(['visible'], titles(results))
+            self.assertEqual(1, results.count())
+
+        # the admin applies the same program rule, but guests can still
+        # see the confidential documents of their program there
+        from documents import visibility
+        self.assertEqual(['secret', 'visible'], sorted(d.title for d in
+            visibility.filter_documents(Document.objects.filter(
+                deleted=False), request)))
+
+        # moving a document to another program takes it out of the scope
+        self.change_document_by_post(Document.objects.get(title='visible'),
+            programs=[programs[1].id])
+        self.assertEqual([], titles(sqs.visible_to(request)))
+
+    def test_search_results_render_from_stored_fields(self):
+        from documents.search_queries import (DocumentSearchQuerySet,
+            render_results)
+
+        self.assert_create_document_by_post(title='stored', authors=[
+            self.ringo.id])
+        doc = Document.objects.get()
+
+        results = list(DocumentSearchQuerySet())
+        with self.assertNumQueries(0):
+            html = render_results(results)
+
+        self.assertIn("<a href='%s'>stored</a>" % doc.get_absolute_url(),
+            html)
+        self.assertIn(self.ringo.full_name, html)
+        self.assertIn(doc.document_type.name, html)
+        self.assertIn(doc.programs.all()[0].name, html)
+
+        # the stored names follow changes made in the admin
+        self.change_document_by_post(doc, authors=[self.ken.id])
+        html = render_results(list(DocumentSearchQuerySet()))
+        self.assertIn(self.ken.full_name, html)
+        self.assertNotIn(self.ringo.full_name, html)
+
+    def test_search_result_snippets_come_from_bounded_summary(self):
+        from documents.search_queries import (DocumentSearchQuerySet,
+            render_results)
+
+        f = StringIO('needle ' + 'haystack ' * 10000)
+        setattr(f, 'name', 'big.txt')
+
+        with self.settings(DOCUMENTS_SUMMARY_SIZE=1000):
+            self.assert_create_document_by_post(file=f)
+
+        result = DocumentSearchQuerySet()[0]
+        self.assertTrue(len(result.summary) <= 1000)
+        self.assertIn("<em>needle</em> haystack",
+            render_results([result], 'needle'))
+
+    def test_document_view_fields_are_cached_until_document_changes(self):
+        from documents import view_cache
+
+        doc = Document(title="foo", document_type=DocumentType.objects.all()[0],
+            notes="bonk", uploader=self.john)
+        doc.save()
+        doc.authors = [self.ringo]
+        url = reverse('admin:documents_document_readonly', args=[doc.id])
+        view_cache.reset_stats()
+
+        self.assertContains(self.client.get(url), self.ringo.full_name)
+        self.assertContains(self.client.get(url), self.ringo.full_name)
+        self.assertEqual((1, 1, 0.5), view_cache.get_stats())
+
+        doc.authors = [self.ken]
+        response = self.client.get(url)
+        self.assertContains(response, self.ken.full_name)
+        self.assertNotContains(response, self.ringo.full_name)
+        self.assertEqual(2, view_cache.get_stats()[1])
+
+        # changed with update(), without sending any signals
+        doc.set_extraction_status(Document.EXTRACTION_DEGRADED)
+        self.client.get(url)
+        self.assertEqual(3, view_cache.get_stats()[1])
+
+        # saving a user without changing their name, as logging in does,
+        # keeps the cached pages
+        self.ken.save()
+        self.client.get(url)
+        self.assertEqual(3, view_cache.get_stats()[1])
+
+        self.ken.full_name = "Kenneth"
+        self.ken.save()
+        self.assertContains(self.client.get(url), "Kenneth")
+        self.assertEqual(4, view_cache.get_stats()[1])
+
     def test_document_view_does_not_send_email(self):
         self.assert_create_document_by_post()
 
@@ -509,6 +1077,103 @@ class DocumentsModuleTest(AptivateEnhancedTestCase, DocumentTestMixin):
         self.assert_delete_document(doc)
         self.assert_no_emails()
     
+    def test_bulk_delete_and_restore_actions(self):
+        self.assert_create_document_by_post(title='one')
+        self.assert_create_document_by_post(title='two')
+        ids = list(Document.objects.values_list('id', flat=True))
+
+        self.client.logout()
+        self.login(self.ringo)
+
+        from documents import extractors
+        def must_not_extract(file, original_name):
+            raise AssertionError("should not extract the files again")
+        extractors.tika.extract = must_not_extract
+
+        from search.queries import SearchQuerySetWithAllFields
+        sqs = SearchQuerySetWithAllFields().models(Document)
+        url = reverse('admin:documents_document_changelist')
+
+        try:
+            self.client.post(url, {'action': 'soft_delete_selected',
+                '_selected_action': ids}, follow=True)
+            self.assertEqual(2, Document.objects.filter(deleted=True).count())
+            self.assertEqual(2, len(sqs.filter(deleted=True)))
+
+            # one email for both documents
+            self.assertEqual(1, len(self.emails))
+            self.assertItemsEqual([self.john.email], self.emails[0].to)
+            self.assertItemsEqual(ids,
+                [d.id for d in self.emails[0].context['documents']])
+
+            self.client.post(url, {'action': 'restore_selected',
+                '_selected_action': ids}, follow=True)
+            self.assertEqual(0, Document.objects.filter(deleted=True).count())
+            self.assertEqual(0, len(sqs.filter(deleted=True)))
+            self.assertEqual(2, len(self.emails))
+
+            # both changes appear in each document's history
+            from django.contrib.admin.models import LogEntry
+            for id in ids:
+                self.assertEqual(["Deleted.", "Restored."], [e.change_message
+                    for e in LogEntry.objects.filter(object_id=str(id),
+                        user=self.ringo).order_by('id')])
+        finally:
+            del extractors.tika.extract
+
+    def test_queued_email_is_sent_by_command(self):
+        from django.core import mail
+        from django.core.management import call_command
+        from documents.models import OutgoingEmail
+
+        self.assert_create_document_by_post(title='one')
+        self.assert_create_document_by_post(title='two')
+        self.client.logout()
+        self.login(self.ringo)
+
+        with self.settings(DOCUMENTS_QUEUED_EMAIL=True):
+            for doc in Document.objects.all():
+                self.change_document_by_post(doc, notes='changed')
+
+        self.assert_no_emails()
+        self.assertEqual(2, OutgoingEmail.objects.count())
+
+        mail.outbox = []
+        call_command('send_queued_email', verbosity=0)
+        self.assertEqual(2, len(mail.outbox))
+        self.assertItemsEqual([self.john.email], mail.outbox[0].to)
+        self.assertEqual(0, OutgoingEmail.objects.count())
+
+    def test_queued_email_digest_combines_changes(self):
+        import datetime
+        from django.core import mail
+        from django.core.management import call_command
+        from documents.models import OutgoingEmail
+
+        self.assert_create_document_by_post(title='one')
+        self.assert_create_document_by_post(title='two')
+        self.client.logout()
+        self.login(self.ringo)
+
+        with self.settings(DOCUMENTS_QUEUED_EMAIL=True,
+            DOCUMENTS_EMAIL_DIGEST_INTERVAL=3600):
+
+            for doc in Document.objects.all():
+                self.change_document_by_post(doc, notes='changed')
+
+            # not due yet
+            mail.outbox = []
+            call_command('send_queued_email', verbosity=0)
+            self.assertEqual([], mail.outbox)
+
+            OutgoingEmail.objects.update(created=datetime.datetime.now() -
+                datetime.timedelta(hours=2))
+            call_command('send_queued_email', verbosity=0)
+
+        self.assertEqual(1, len(mail.outbox))
+        self.assertIn("2 changes", mail.outbox[0].subject)
+        self.assertEqual(0, OutgoingEmail.objects.count())
+
     def test_document_has_confidential_flag(self):
         self.assert_create_document_by_post(confidential=True)
 
@@ -555,6 +1220,73 @@ class DocumentsModuleTest(AptivateEnhancedTestCase, DocumentTestMixin):
         self.assertIsInstance(field.form[field_name].field.widget,
             AdminFileWidgetWithSize)
         
+    def test_document_download_checks_scope_and_supports_ranges(self):
+        from django.contrib.auth.models import Group
+
+        self.assert_create_document_by_post(
+            programs=Program.objects.all()[0].id)
+        doc = Document.objects.order_by('-id')[0]
+        url = doc.file.url
+        self.assertTrue(url.startswith(reverse(
+            'org.aptivate.intranet.documents.download',
+            kwargs={'name': doc.file.name})))
+
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('foobar', ''.join(response))
+        self.assertIn("filename*=UTF-8''", response['Content-Disposition'])
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_RANGE='bytes=3-')
+        self.assertEqual(206, response.status_code)
+        self.assertEqual('bar', ''.join(response))
+        self.assertEqual('bytes 3-5/6', response['Content-Range'])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+
+        from documents.downloads import parse_range
+        self.assertIs(False, parse_range('bytes=-5', 0))
+        self.assertIs(None, parse_range(None, 0))
+
+        with self.settings(DOCUMENTS_DOWNLOAD_METHOD='x-sendfile'):
+            response = self.client.get(url)
+            self.assertEqual(doc.file.path, response['X-Sendfile'])
+            self.assertEqual('', response.content)
+
+        # a guest in another program can't see it
+        self.ken.program = Program.objects.all()[1]
+        self.ken.save()
+        self.ken.groups.add(Group.objects.get(name="Guest"))
+        self.client.logout()
+        self.login(self.ken)
+        self.assertEqual(404, self.client.get(url).status_code)
+
+    def test_duplicate_uploads_share_one_stored_file(self):
+        import os.path
+
+        self.assert_create_document_by_post(title='one')
+        response = self.assert_create_document_by_post(title='two')
+        self.assertContains(response, "same as the one attached to: one")
+
+        (one, two) = Document.objects.order_by('id')
+        self.assertEqual(one.file.name, two.file.name)
+        self.assertEqual(one.file_digest, two.file_digest)
+        self.assertTrue(one.file_digest)
+        path = one.file.path
+
+        # the file is only deleted after the last document that uses it,
+        # by the delete_unused_files command
+        from django.core.management import call_command
+        one.delete()
+        call_command('delete_unused_files', min_age=0, verbosity=0)
+        self.assertTrue(os.path.exists(path))
+        two.delete()
+        call_command('delete_unused_files', verbosity=0)
+        self.assertTrue(os.path.exists(path))
+        call_command('delete_unused_files', min_age=0, verbosity=0)
+        self.assertFalse(os.path.exists(path))
+
     def test_document_has_external_author_field(self):
         self.login()
         self.assert_create_document_by_post(external_authors="John Smith")
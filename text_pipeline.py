@@ -0,0 +1,107 @@
+"""
+Post-processing of extracted text before it's indexed, to keep the index
+compact. Spreadsheets in particular can turn into megabytes of
+whitespace, page header codes and repeated rows.
+
+settings.DOCUMENTS_TEXT_PIPELINE is the list of stages to run, in order,
+by name from STAGES. The default only enforces the character budget,
+settings.DOCUMENTS_TEXT_MAX_CHARS (2,000,000 by default, None for no
+limit), so that the indexed text doesn't change otherwise. Boilerplate is
+removed by the regular expressions in settings.DOCUMENTS_TEXT_BOILERPLATE,
+which default to the header and footer codes of Excel worksheets.
+
+The number of characters removed by each stage is counted in stats, for
+this process, and the text_pipeline_stats command reports what the
+pipeline would save on the extracted text cache.
+"""
+
+import re
+
+from django.conf import settings
+
+DEFAULT_PIPELINE = ('truncate',)
+
+DEFAULT_BOILERPLATE = (
+    # Excel page header and footer codes, e.g. &"Times New Roman,Regular"&12&A
+    r'&"[^"\n]*"&\d+(?:&[A-Z]|Page &P)?',
+)
+
+stats = {'documents': 0}
+
+def collapse_whitespace(text):
+    """
+    Replace runs of spaces and tabs with a single space, remove spaces
+    at the ends of lines, and leave at most one blank line in a row.
+    """
+
+    text = re.sub(r'[ \t\r\f\v]+', ' ', text)
+    text = re.sub(r' ?\n ?', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+def remove_boilerplate(text):
+    for pattern in getattr(settings, 'DOCUMENTS_TEXT_BOILERPLATE',
+        DEFAULT_BOILERPLATE):
+        text = re.sub(pattern, '', text)
+    return text
+
+def remove_duplicate_lines(text):
+    """
+    Remove lines that repeat an earlier line, apart from blank ones,
+    which add nothing to the index.
+    """
+
+    seen = set()
+    lines = []
+
+    for line in text.split('\n'):
+        key = line.strip()
+        if key:
+            if key in seen:
+                continue
+            seen.add(key)
+        lines.append(line)
+
+    return '\n'.join(lines)
+
+def truncate(text):
+    max_chars = getattr(settings, 'DOCUMENTS_TEXT_MAX_CHARS', 2000000)
+
+    if max_chars is not None and len(text) > max_chars:
+        return text[:max_chars]
+
+    return text
+
+STAGES = {
+    'collapse_whitespace': collapse_whitespace,
+    'remove_boilerplate': remove_boilerplate,
+    'remove_duplicate_lines': remove_duplicate_lines,
+    'truncate': truncate,
+}
+
+def get_pipeline():
+    return getattr(settings, 'DOCUMENTS_TEXT_PIPELINE', DEFAULT_PIPELINE)
+
+def process(text, pipeline=None, counts=None):
+    """
+    Run text through the stages of the pipeline (by default, the one
+    configured in settings), adding the number of characters that each
+    one removes to counts (by default, the module's stats).
+    """
+
+    if text is None:
+        return None
+
+    if pipeline is None:
+        pipeline = get_pipeline()
+    if counts is None:
+        counts = stats
+
+    counts['documents'] = counts.get('documents', 0) + 1
+
+    for name in pipeline:
+        before = len(text)
+        text = STAGES[name](text)
+        counts[name] = counts.get(name, 0) + before - len(text)
+
+    return text
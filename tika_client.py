@@ -0,0 +1,345 @@
+"""
+A small client for the Apache Tika server(s) configured in
+settings.TIKA_SERVER, used to extract text from uploaded documents.
+
+TIKA_SERVER may be a single URL or a list of URLs, in which case requests
+are spread across them in turn. Connections are kept alive and reused
+from a pool of up to TIKA_POOL_SIZE idle connections per server, and
+requests that fail because a connection was reset are retried up to
+TIKA_RETRIES times, backing off TIKA_RETRY_BACKOFF seconds (doubling
+each time) between attempts.
+
+File bodies are streamed to Tika with chunked transfer encoding, and at
+most TIKA_MAX_TEXT_SIZE bytes of extracted text are read back, so memory
+use doesn't grow with the size of the document. A request may also be
+given a deadline, after which it fails with socket.timeout even if the
+server is still (slowly) sending data.
+"""
+
+import httplib
+import itertools
+import socket
+import threading
+import time
+
+from Queue import Queue, Empty, Full
+
+from django.conf import settings
+
+CHUNK_SIZE = 64 * 1024
+
+def check_deadline(deadline):
+    if deadline is not None and time.time() > deadline:
+        raise socket.timeout("Deadline for TIKA request exceeded")
+
+def trim_partial_character(data):
+    """
+    Remove the start of a UTF-8 character that was cut off at the end of
+    data, leaving the rest as it is.
+    """
+
+    # the first byte of a character is the last one that isn't 10xxxxxx
+    for i in range(1, min(len(data), 4) + 1):
+        byte = ord(data[-i])
+
+        if byte & 0xC0 != 0x80:
+            if byte >= 0xF0:
+                length = 4
+            elif byte >= 0xE0:
+                length = 3
+            elif byte >= 0xC0:
+                length = 2
+            else:
+                length = 1
+
+            return data[:-i] if i < length else data
+
+    return data
+
+def read_limited(stream, max_size, deadline=None):
+    """
+    Read UTF-8 text from a stream in chunks until it ends, or until
+    max_size bytes if that's not None, without splitting a character.
+    Returns a tuple of (data, truncated).
+    """
+
+    chunks = []
+    size = 0
+
+    while max_size is None or size < max_size:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return (''.join(chunks), False)
+        chunks.append(chunk)
+        size += len(chunk)
+        check_deadline(deadline)
+
+    return (trim_partial_character(''.join(chunks)[:max_size]), True)
+
+class Endpoint(object):
+    """
+    One Tika server, with a pool of idle keep-alive connections to it.
+    """
+
+    def __init__(self, url, pool_size, timeout):
+        from urlparse import urlparse
+        tika = urlparse(url)
+
+        if tika.scheme == 'http':
+            self.connection_class = httplib.HTTPConnection
+        elif tika.scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        else:
+            raise Exception("Unknown URL scheme '%s' in Apache Tika URL: %s" %
+                (tika.scheme, url))
+
+        self.url = url
+        self.netloc = tika.netloc
+        self.path = tika.path
+        self.timeout = timeout
+        self.idle = Queue(pool_size)
+
+    def get_connection(self):
+        """
+        Return a tuple of (connection, reused), taking an idle connection
+        from the pool if there is one, otherwise opening a new one.
+        """
+
+        try:
+            return (self.idle.get_nowait(), True)
+        except Empty:
+            pass
+
+        conn = self.connection_class(self.netloc, strict=True,
+            timeout=self.timeout)
+        conn.connect()
+        # httplib sends the headers and a file body in separate packets,
+        # which would otherwise wait for a delayed ACK from the server
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return (conn, False)
+
+    def release(self, conn):
+        try:
+            self.idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+class TikaPool(object):
+    def __init__(self, urls, pool_size=4, timeout=30, retries=3,
+        backoff=0.5):
+
+        self.endpoints = [Endpoint(url, pool_size, timeout) for url in urls]
+        self.retries = retries
+        self.backoff = backoff
+        self._next = itertools.cycle(self.endpoints)
+        self._lock = threading.Lock()
+
+    def next_endpoint(self):
+        with self._lock:
+            return self._next.next()
+
+    def send(self, conn, method, url, body, deadline=None):
+        """
+        Send a request with a body that may be a string, or a file-like
+        object which is streamed in chunks without reading it all into
+        memory.
+        """
+
+        if not hasattr(body, 'read'):
+            conn.request(method, url, body)
+            return
+
+        conn.putrequest(method, url)
+        conn.putheader('Transfer-Encoding', 'chunked')
+        conn.endheaders()
+
+        while True:
+            chunk = body.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+            check_deadline(deadline)
+
+        conn.send('0\r\n\r\n')
+
+    def request(self, method, path, body=None, max_size=None,
+        deadline=None, retries=None):
+        """
+        Send a request to the next Tika server and return the body of its
+        response, raising an Exception unless the status is 200 OK.
+        At most max_size bytes of the response are returned, if given,
+        and socket.timeout is raised if it takes longer than the
+        deadline (a time.time() value), including any retries. Failed
+        connections are retried self.retries times, unless retries is
+        given.
+        """
+
+        if retries is None:
+            retries = self.retries
+
+        attempt = 0
+
+        while True:
+            endpoint = self.next_endpoint()
+            conn = None
+            reused = False
+
+            try:
+                (conn, reused) = endpoint.get_connection()
+
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+
+                self.send(conn, method, endpoint.path + path, body, deadline)
+                response = conn.getresponse()
+                (data, truncated) = read_limited(response, max_size,
+                    deadline)
+            except socket.timeout:
+                if conn is not None:
+                    conn.close()
+                raise
+            except (socket.error, httplib.HTTPException) as e:
+                if conn is not None:
+                    conn.close()
+
+                if reused:
+                    # The server probably closed this idle connection,
+                    # try again straight away with another one.
+                    continue
+
+                if attempt >= retries:
+                    raise Exception("Failed to connect to TIKA server " +
+                        "(%s): %s" % (endpoint.url, e))
+
+                time.sleep(self.backoff * (2 ** attempt))
+                check_deadline(deadline)
+                attempt += 1
+                continue
+
+            if truncated or response.will_close:
+                # we can't reuse a connection with unread data waiting
+                conn.close()
+            else:
+                endpoint.release(conn)
+
+            if response.status != 200:
+                raise Exception("Unknown response from TIKA server " +
+                    "(%s): %s: %s" % (endpoint.url, response.status,
+                        response.reason))
+
+            return data
+
+def get_server_urls():
+    urls = settings.TIKA_SERVER
+
+    if isinstance(urls, basestring):
+        urls = [urls]
+
+    return list(urls)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Return the pool of connections to the configured Tika servers, shared
+    by all threads in this process.
+    """
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = TikaPool(get_server_urls(),
+                pool_size=getattr(settings, 'TIKA_POOL_SIZE', 4),
+                timeout=getattr(settings, 'TIKA_TIMEOUT', 30),
+                retries=getattr(settings, 'TIKA_RETRIES', 3),
+                backoff=getattr(settings, 'TIKA_RETRY_BACKOFF', 0.5))
+
+        return _pool
+
+def reset_pool():
+    """
+    Forget the current pool without closing its connections, for example
+    in a child process that must not share its parent's sockets.
+    """
+
+    global _pool
+
+    with _pool_lock:
+        _pool = None
+
+def request(method, path, body=None, max_size=None, deadline=None,
+    retries=None):
+    return get_pool().request(method, path, body, max_size, deadline,
+        retries)
+
+def get_max_text_size():
+    return getattr(settings, 'TIKA_MAX_TEXT_SIZE', 16 * 1024 * 1024)
+
+def extract_text(body, max_size=None, timeout=None):
+    """
+    Send the contents of a file (a string or a file-like object) to Tika,
+    and return the plain text that it extracts from it, truncated to
+    max_size or settings.TIKA_MAX_TEXT_SIZE bytes (16 MB by default, None
+    for no limit). Raises socket.timeout if it takes more than timeout
+    seconds in total.
+    """
+
+    if max_size is None:
+        max_size = get_max_text_size()
+
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+
+    return request('PUT', '/tika', body, max_size, deadline)
+
+_version = None
+# (time until which we don't ask again, exception) after a failure
+_version_error = None
+
+def get_version(retry=True):
+    """
+    Return the version string reported by the Tika server, or
+    settings.TIKA_VERSION if set. Cached for the life of the process,
+    so it costs one request at most while the server is up.
+
+    If the server can't be reached, the exception is raised again
+    without asking it for the next TIKA_VERSION_RETRY_INTERVAL seconds
+    (60 by default), so that a server that's down doesn't slow down
+    every lookup. With retry=False, failed connections aren't retried,
+    for callers that only want to look up text that we already have.
+    """
+
+    global _version, _version_error
+
+    if _version is None:
+        _version = getattr(settings, 'TIKA_VERSION', None)
+
+    if _version is not None:
+        return _version
+
+    if _version_error is not None and time.time() < _version_error[0]:
+        raise _version_error[1]
+
+    try:
+        _version = request('GET', '/version',
+            retries=None if retry else 0).strip()
+    except Exception as e:
+        _version_error = (time.time() +
+            getattr(settings, 'TIKA_VERSION_RETRY_INTERVAL', 60), e)
+        raise
+
+    _version_error = None
+    return _version
+
+def reset_version():
+    """
+    Forget the version of the Tika server, and any failure to get it,
+    for example after upgrading it.
+    """
+
+    global _version, _version_error
+    _version = None
+    _version_error = None
@@ -8,4 +8,8 @@ urlpatterns = patterns('',
     # Examples:
     url(r'^$', views.IndexView.as_view(),
         name=NAME_PREFIX + "index"),
+    url(r'^autocomplete/(?P<source>\w+)/$', views.AutocompleteView.as_view(),
+        name=NAME_PREFIX + "autocomplete"),
+    url(r'^download/(?P<name>.+)$', views.DownloadView.as_view(),
+        name=NAME_PREFIX + "download"),
 )
@@ -0,0 +1,158 @@
+"""
+Caching of the rendered fields of the read-only document page, which
+search results link to, so that it doesn't look up the authors, programs,
+document type and uploader every time.
+
+The cache key includes a version number for the document, which changes
+whenever the document or its authors or programs are saved (or updated
+in bulk, see bump_documents()), and a global version, which changes
+whenever the name of a user, program or document type changes, since
+their names appear on the page. It also includes the user's visibility
+scope (see visibility.py), so that users who may see different things
+never share a cached page. Fragments are kept for
+settings.DOCUMENTS_VIEW_CACHE_TIMEOUT seconds (an hour by default).
+
+Hits and misses are counted in the cache, across all processes; see
+get_stats() and the document_view_cache_stats command.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import signals
+
+from binder.models import IntranetUser, Program
+from models import Document, DocumentType, will_change
+import visibility
+
+GLOBAL_VERSION_KEY = 'documents.view_cache.version'
+HITS_KEY = 'documents.view_cache.hits'
+MISSES_KEY = 'documents.view_cache.misses'
+
+def get_timeout():
+    return getattr(settings, 'DOCUMENTS_VIEW_CACHE_TIMEOUT', 3600)
+
+def get_counter_timeout():
+    # version numbers and hit counters must outlive the fragments that
+    # they describe, but not forever if the cache never evicts them
+    return get_timeout() * 2
+
+def get_document_version_key(document_id):
+    return 'documents.view_cache.version.%d' % document_id
+
+def get_version(key):
+    version = cache.get(key)
+
+    if version is None:
+        # not a small number, in case fragments cached under an earlier
+        # version outlived the version number
+        cache.add(key, int(time.time()), get_counter_timeout())
+        version = cache.get(key, 0)
+
+    return version
+
+def bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # not in the cache, get_version() will start a new one
+        pass
+
+def bump_documents(document_ids):
+    """
+    Invalidate the cached pages of documents changed without sending
+    signals, for example by QuerySet.update().
+    """
+
+    for document_id in document_ids:
+        bump(get_document_version_key(document_id))
+
+def get_key(document, request):
+    """
+    Return the cache key for the read-only page of a document, as seen
+    by the user who made the request.
+    """
+
+    (is_guest, program_id) = visibility.get_scope(request)
+
+    return 'documents.view_cache.fragment.%d.%s.%s.%s.%s' % (document.pk,
+        get_version(GLOBAL_VERSION_KEY),
+        get_version(get_document_version_key(document.pk)),
+        int(is_guest), program_id)
+
+def get_fragment(key):
+    value = cache.get(key)
+    counter = MISSES_KEY if value is None else HITS_KEY
+
+    if not cache.add(counter, 1, get_counter_timeout()):
+        try:
+            cache.incr(counter)
+        except ValueError:
+            pass
+
+    return value
+
+def set_fragment(key, value):
+    cache.set(key, value, get_timeout())
+
+def get_stats():
+    """
+    Return a tuple of (hits, misses, hit rate), since the counters were
+    last reset.
+    """
+
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return (hits, misses, float(hits) / total if total else 0.0)
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+def document_changed(sender, instance, **kwargs):
+    bump(get_document_version_key(instance.pk))
+
+def relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if not reverse:
+        bump(get_document_version_key(instance.pk))
+    else:
+        # a user or program was added to or removed from documents
+        bump(GLOBAL_VERSION_KEY)
+
+# the fields of other models that appear on the page
+NAME_FIELDS = {
+    IntranetUser: 'full_name',
+    Program: 'name',
+    DocumentType: 'name',
+}
+
+def check_name(sender, instance, **kwargs):
+    instance._view_cache_name_changed = will_change(instance,
+        [NAME_FIELDS[sender]])
+
+def names_changed(sender, instance, **kwargs):
+    # not when a user logs in, for example, which saves last_login
+    if instance.__dict__.pop('_view_cache_name_changed', True):
+        bump(GLOBAL_VERSION_KEY)
+
+signals.post_save.connect(document_changed, sender=Document,
+    dispatch_uid="documents_view_cache_document_saved")
+signals.post_delete.connect(document_changed, sender=Document,
+    dispatch_uid="documents_view_cache_document_deleted")
+
+for field in (Document.authors.field, Document.programs.field):
+    signals.m2m_changed.connect(relations_changed,
+        sender=field.rel.through,
+        dispatch_uid="documents_view_cache_%s_changed" % field.name)
+
+for model in NAME_FIELDS:
+    signals.pre_save.connect(check_name, sender=model,
+        dispatch_uid="documents_view_cache_%s_saving" %
+            model._meta.object_name.lower())
+    signals.post_save.connect(names_changed, sender=model,
+        dispatch_uid="documents_view_cache_%s_saved" %
+            model._meta.object_name.lower())
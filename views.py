@@ -1,10 +1,20 @@
 # Create your views here.
 
-from django.views.generic.base import TemplateView
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+from django.utils import simplejson
+from django.utils.decorators import method_decorator
+from django.views.generic.base import TemplateView, View
 
 import settings
 import binder.main_menu
 
+from models import Document
+import autocomplete
+import downloads
+import visibility
+
 class IndexView(TemplateView):
     template_name = 'index.dhtml'
     
@@ -17,3 +27,59 @@ class IndexView(TemplateView):
         # print "get_context_data: %s" % str(binder.main_menu.generate())
         return self.extra_context
     """
+
+class AutocompleteView(View):
+    """
+    Return one page of the authors or programs (the source) whose names
+    start with the q parameter, as JSON for the autocomplete widget:
+    {"results": [{"id": 1, "text": "John Smith"}, ...], "more": false}
+    """
+
+    @method_decorator(staff_member_required)
+    def dispatch(self, request, *args, **kwargs):
+        return super(AutocompleteView, self).dispatch(request, *args,
+            **kwargs)
+
+    def get(self, request, source):
+        if source not in autocomplete.sources:
+            raise Http404
+
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+
+        (results, more) = autocomplete.sources[source].search(
+            request.GET.get('q', ''), page)
+
+        return HttpResponse(simplejson.dumps({
+            'results': [{'id': pk, 'text': label} for pk, label in results],
+            'more': more,
+        }), content_type='application/json')
+
+class DownloadView(View):
+    """
+    Send the file with the given name, if the user may view documents,
+    and may see at least one document with that file (see visibility.py).
+    See downloads.py for how it's sent.
+    """
+
+    @method_decorator(staff_member_required)
+    def dispatch(self, request, *args, **kwargs):
+        return super(DownloadView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, name):
+        if not (request.user.has_perm('documents.view_document') or
+            request.user.has_perm('documents.change_document')):
+            raise PermissionDenied
+
+        documents = Document.objects.filter(file=name, deleted=False). \
+            filter(**visibility.get_filters(request))
+
+        try:
+            document = documents[0]
+        except IndexError:
+            # don't tell them whether it exists
+            raise Http404
+
+        return downloads.serve(request, document)
@@ -0,0 +1,117 @@
+"""
+Which documents a user may see. Members of the Guest group only see the
+documents of their own program in the admin, and in search results and
+downloads, only those that aren't confidential; everyone else sees them
+all.
+
+Working that out costs a query on the user's groups, so the answer is
+remembered on the request, and in the cache for
+settings.DOCUMENTS_SCOPE_CACHE_TIMEOUT seconds (60 by default), until
+the user's groups or program change. The admin uses get_admin_filters(),
+and the search views and file downloads get_filters(), which adds the
+confidentiality rule to the same program rule.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import signals
+
+from binder.models import IntranetUser
+
+def get_cache_key(user_id):
+    return 'documents.visibility.scope.%d' % user_id
+
+def get_scope(request):
+    """
+    Return a tuple of (is_guest, program_id) for the user who made the
+    request, where program_id is the program that their documents are
+    limited to, or None if they can see all documents.
+    """
+
+    user = request.user
+    scope = getattr(request, '_documents_scope', None)
+
+    if scope is not None and scope[0] == user.pk:
+        return scope[1]
+
+    if user.pk is None:
+        # anonymous users never get this far in the admin
+        return (False, None)
+
+    key = get_cache_key(user.pk)
+    value = cache.get(key)
+
+    if value is None:
+        is_guest = user.groups.filter(name='Guest').exists()
+        program_id = getattr(user, 'program_id', None) if is_guest else None
+        value = (is_guest, program_id)
+        cache.set(key, value,
+            getattr(settings, 'DOCUMENTS_SCOPE_CACHE_TIMEOUT', 60))
+
+    request._documents_scope = (user.pk, value)
+    return value
+
+def get_program_id(request):
+    return get_scope(request)[1]
+
+def get_admin_filters(request):
+    """
+    Return the filters that limit documents to those that the user may
+    see in the admin: guests can only see their own program's documents.
+    """
+
+    program_id = get_program_id(request)
+
+    if program_id:
+        return {'programs': program_id}
+    else:
+        return {}
+
+def get_filters(request):
+    """
+    Return the filters that limit documents to those that the user may
+    find by searching or download: as in the admin, and never
+    confidential ones for guests. They work both on a queryset of
+    Documents and on the search index.
+    """
+
+    filters = get_admin_filters(request)
+
+    if get_scope(request)[0]:
+        filters['confidential'] = False
+
+    return filters
+
+def filter_documents(queryset, request):
+    """
+    Limit a queryset of Documents to those that the user may see in the
+    admin.
+    """
+
+    return queryset.filter(**get_admin_filters(request))
+
+def invalidate(user_id):
+    cache.delete(get_cache_key(user_id))
+
+def user_saved(sender, instance, **kwargs):
+    invalidate(instance.pk)
+
+def groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # the groups of one user changed
+        if action.startswith('post_'):
+            invalidate(instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        # some users were added to or removed from one group
+        for user_id in pk_set:
+            invalidate(user_id)
+    elif action == 'pre_clear':
+        # everyone is about to be removed from one group
+        for user_id in instance.user_set.values_list('pk', flat=True):
+            invalidate(user_id)
+
+signals.post_save.connect(user_saved, sender=IntranetUser,
+    dispatch_uid="documents_visibility_user_saved")
+signals.m2m_changed.connect(groups_changed,
+    sender=IntranetUser.groups.through,
+    dispatch_uid="documents_visibility_groups_changed")
@@ -0,0 +1,37 @@
+from django.core.urlresolvers import reverse
+from django.forms.widgets import SelectMultiple
+
+from urls import NAME_PREFIX
+
+class AutocompleteSelectMultiple(SelectMultiple):
+    """
+    A multiple select that only renders the options that are already
+    selected, and lets the user add more by searching the autocomplete
+    view for the given source, rather than listing every possible choice.
+    Must be used with a ModelMultipleChoiceField.
+    """
+
+    def __init__(self, source, attrs=None):
+        super(AutocompleteSelectMultiple, self).__init__(attrs)
+        self.source = source
+
+    class Media:
+        js = ('documents/js/autocomplete.js',)
+
+    def render(self, name, value, attrs=None, choices=()):
+        attrs = dict(attrs or {})
+        attrs['class'] = (attrs.get('class', '') + ' autocomplete').strip()
+        attrs['data-autocomplete-url'] = reverse(NAME_PREFIX + 'autocomplete',
+            kwargs={'source': self.source})
+
+        field = self.choices.field
+        selected = field.queryset.filter(pk__in=value or [])
+        all_choices = self.choices
+        self.choices = [(obj.pk, field.label_from_instance(obj))
+            for obj in selected]
+
+        try:
+            return super(AutocompleteSelectMultiple, self).render(name, value,
+                attrs, choices)
+        finally:
+            self.choices = all_choices